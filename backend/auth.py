@@ -1,24 +1,55 @@
 import os
-import jwt
-import requests
+import threading
+import time
 from fastapi import HTTPException, Security
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from dotenv import load_dotenv
-from functools import lru_cache
 
-load_dotenv()
+# jwt (with cryptography) and requests are imported on first use: they are only
+# needed for real token checks and are slow to import on a cold start.
 
 # allow missing credentials to be handled in our verify_token (so we can bypass in dev)
 security = HTTPBearer(auto_error=False)
 
-CLERK_SECRET_KEY = os.getenv("CLERK_SECRET_KEY")
 CLERK_JWKS_URL = "https://touched-raptor-54.clerk.accounts.dev/.well-known/jwks.json"
+JWKS_TTL_SECONDS = float(os.getenv("JWKS_TTL_SECONDS", "3600"))
+JWKS_MIN_REFRESH_SECONDS = 60
+
+_jwks = None
+_jwks_fetched_at = 0.0
+_jwks_lock = threading.Lock()
+
+
+def auth_disabled() -> bool:
+    return os.getenv("DISABLE_AUTH", "false").lower() == "true"
+
+
+def get_jwks(refresh: bool = False):
+    """Clerk's JWKS, cached per process for JWKS_TTL_SECONDS.
+
+    ``refresh`` refetches (at most every JWKS_MIN_REFRESH_SECONDS) when a token
+    names a key id the cached set does not have, e.g. after a key rotation.
+    Workers don't coordinate this: the JWKS is the same public document for
+    every worker, so each refetches on its own and they converge within one
+    TTL, without a round trip through the invalidation table.
+    """
+    global _jwks, _jwks_fetched_at
+    now = time.monotonic()
+    cached = _jwks
+    if cached is not None:
+        age = now - _jwks_fetched_at
+        if age < JWKS_TTL_SECONDS and not (refresh and age >= JWKS_MIN_REFRESH_SECONDS):
+            return cached
+    with _jwks_lock:
+        if _jwks is not cached:
+            return _jwks  # another thread just refreshed
+        import requests
+
+        response = requests.get(CLERK_JWKS_URL, timeout=10)
+        response.raise_for_status()
+        _jwks = response.json()
+        _jwks_fetched_at = time.monotonic()
+        return _jwks
 
-@lru_cache(maxsize=1)
-def get_jwks():
-    """Fetch and cache Clerk's JWKS"""
-    response = requests.get(CLERK_JWKS_URL)
-    return response.json()
 
 def verify_token(credentials: HTTPAuthorizationCredentials = Security(security)):
     """Verify Clerk JWT token.
@@ -28,9 +59,11 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Security(security))
     HTTPBearer, `credentials` may be None if no Authorization header is provided.
     """
     # Development bypass
-    if os.getenv("DISABLE_AUTH", "false").lower() == "true":
+    if auth_disabled():
         return {"sub": "dev"}
 
+    import jwt
+
     try:
         if credentials is None:
             # No credentials provided
@@ -41,12 +74,14 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Security(security))
         unverified_header = jwt.get_unverified_header(token)
         kid = unverified_header.get("kid")
         
-        # Get JWKS and find the matching key
-        jwks = get_jwks()
+        # Get JWKS and find the matching key; an unknown kid may mean the keys rotated
         key = None
-        for jwk_key in jwks.get("keys", []):
-            if jwk_key.get("kid") == kid:
-                key = jwt.algorithms.RSAAlgorithm.from_jwk(jwk_key)
+        for refresh in (False, True):
+            for jwk_key in get_jwks(refresh=refresh).get("keys", []):
+                if jwk_key.get("kid") == kid:
+                    key = jwt.algorithms.RSAAlgorithm.from_jwk(jwk_key)
+                    break
+            if key:
                 break
         
         if not key:
@@ -68,3 +103,19 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Security(security))
         raise HTTPException(status_code=401, detail=f"Invalid token: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=401, detail=f"Authentication failed: {str(e)}")
+
+
+def admin_user_ids() -> set:
+    return {user_id.strip() for user_id in os.getenv("ADMIN_USER_IDS", "").split(",") if user_id.strip()}
+
+
+def require_admin(payload: dict = Security(verify_token)):
+    """Verify the token and require its subject to be listed in ADMIN_USER_IDS.
+
+    With DISABLE_AUTH=true every caller is treated as an admin.
+    """
+    if auth_disabled():
+        return payload
+    if payload.get("sub") not in admin_user_ids():
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return payload
@@ -1,9 +1,26 @@
+from pydantic import BaseModel
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
-from typing import List, Optional
+from sqlalchemy import DateTime, case, func, or_
+from sqlalchemy.exc import IntegrityError
+from typing import Dict, Iterable, List, NamedTuple, Optional, Union
+from datetime import datetime, timezone
+from collections import defaultdict
+from functools import lru_cache
 import models
 import schemas
+import search
+import scanner
+import invalidation
+import webhooks
+import hashlib
+import hmac
+import logging
+import os
 import secrets
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
 
 # --- Mock Data and Logic for Guard Function ---
 THREAT_TYPES = [
@@ -33,27 +50,18 @@ def run_leakguard_check(prompt: str) -> List[dict]:
     """
     Simulates the core LeakGuard detection engine logic.
     (In a real application, this would call an external AI/ML model.)
+
+    Uses the same chunked scanner and rules as /v2/guard, without stopping at
+    the first blocking hit so every category is reported.
     """
+    result = scanner.scan([prompt], stop_on_block=False)
     new_results = []
     for threat in THREAT_TYPES:
-        detected = False
-        confidence_value = 10 
-        
-        # Simulated threat detection logic:
-        if threat["type"] == 'Data Leakage' and '374245455400128' in prompt:
-            detected = True
-            confidence_value = 95
-        elif threat["type"] == 'Prompt Attack' and 'developer instructions' in prompt:
-            detected = True
-            confidence_value = 90
-        elif threat["type"] == 'Content Violation' and 'mushrooms' in prompt:
-            detected = True
-            confidence_value = 85
-            
+        confidence_value = result.confidence.get(threat["type"])
         new_results.append({
                 **threat,
-                "detected": detected,
-                "confidenceValue": confidence_value,
+                "detected": confidence_value is not None,
+                "confidenceValue": confidence_value or 10,
         })
 
     return new_results
@@ -72,6 +80,8 @@ def get_project_by_slug(db: Session, slug: str) -> Optional[models.Project]:
 def create_project(db: Session, project: schemas.ProjectCreate) -> models.Project:
     db_project = models.Project(**project.model_dump())
     db.add(db_project)
+    db.flush()
+    invalidation.publish(db, "projects", db_project.id)
     db.commit()
     db.refresh(db_project)
     return db_project
@@ -82,6 +92,7 @@ def update_project(db: Session, project_id: str, project: schemas.ProjectCreate)
     if db_project:
         for key, value in project.model_dump().items():
             setattr(db_project, key, value)
+        invalidation.publish(db, "projects", project_id)
         db.commit()
         db.refresh(db_project)
     return db_project
@@ -90,12 +101,19 @@ def update_project(db: Session, project_id: str, project: schemas.ProjectCreate)
 def delete_project(db: Session, project_id: str) -> bool:
     db_project = get_project(db, project_id)
     if db_project:
+        for webhook in get_webhooks(db, project_id):
+            _delete_webhook_rows(db, webhook)
         db.delete(db_project)
+        invalidation.publish(db, "projects", project_id)
         db.commit()
         return True
     return False
 
 
+def bulk_create_projects(db: Session, projects: Iterable[Union[schemas.ProjectCreate, dict]]) -> List[str]:
+    return bulk_insert(db, models.Project, projects)
+
+
 # Policies CRUD
 def get_policies(db: Session, skip: int = 0, limit: int = 100) -> List[models.Policy]:
     return db.query(models.Policy).offset(skip).limit(limit).all()
@@ -112,6 +130,8 @@ def get_policy(db: Session, policy_id: str) -> Optional[models.Policy]:
 def create_policy(db: Session, policy: schemas.PolicyCreate) -> models.Policy:
     db_policy = models.Policy(**policy.model_dump())
     db.add(db_policy)
+    db.flush()
+    invalidation.publish(db, "policies", db_policy.id)
     db.commit()
     db.refresh(db_policy)
     return db_policy
@@ -122,6 +142,7 @@ def update_policy(db: Session, policy_id: str, policy: schemas.PolicyCreate) ->
     if db_policy:
         for key, value in policy.model_dump().items():
             setattr(db_policy, key, value)
+        invalidation.publish(db, "policies", db_policy.id)
         db.commit()
         db.refresh(db_policy)
     return db_policy
@@ -131,11 +152,16 @@ def delete_policy(db: Session, policy_id: str) -> bool:
     db_policy = get_policy(db, policy_id)
     if db_policy:
         db.delete(db_policy)
+        invalidation.publish(db, "policies", db_policy.id)
         db.commit()
         return True
     return False
 
 
+def bulk_create_policies(db: Session, policies: Iterable[Union[schemas.PolicyCreate, dict]]) -> List[str]:
+    return bulk_insert(db, models.Policy, policies)
+
+
 # API Keys CRUD
 def get_api_keys(db: Session, skip: int = 0, limit: int = 100) -> List[models.ApiKey]:
     return db.query(models.ApiKey).offset(skip).limit(limit).all()
@@ -146,12 +172,22 @@ def get_api_key(db: Session, key_id: str) -> Optional[models.ApiKey]:
 
 
 def create_api_key(db: Session, api_key: schemas.ApiKeyCreate) -> models.ApiKey:
-    """Create an API key. Accepts optional project_id to link key to a project."""
+    """Create an API key. Accepts optional project_id to link key to a project.
+
+    Only the key's prefix and keyed hash are stored. The returned object is
+    detached and its ``key`` holds the plaintext, which is never available again.
+    """
     generated_key = f"lk_{secrets.token_urlsafe(32)}"
-    db_api_key = models.ApiKey(name=api_key.name, key=generated_key, project_id=getattr(api_key, 'project_id', None))
+    db_api_key = models.ApiKey(
+        name=api_key.name, project_id=getattr(api_key, 'project_id', None), **api_key_columns(generated_key)
+    )
     db.add(db_api_key)
+    db.flush()
+    invalidation.publish(db, "api_keys", db_api_key.id)
     db.commit()
     db.refresh(db_api_key)
+    db.expunge(db_api_key)
+    db_api_key.key = generated_key
     return db_api_key
 
 
@@ -159,6 +195,7 @@ def delete_api_key(db: Session, key_id: str) -> bool:
     db_api_key = get_api_key(db, key_id)
     if db_api_key:
         db.delete(db_api_key)
+        invalidation.publish(db, "api_keys", key_id)
         db.commit()
         return True
     return False
@@ -174,23 +211,648 @@ def get_log_entry(db: Session, log_id: str) -> Optional[models.LogEntry]:
 
 
 def create_log_entry(db: Session, log_entry: schemas.LogEntryCreate) -> models.LogEntry:
-    db_log_entry = models.LogEntry(**log_entry.model_dump())
-    db.add(db_log_entry)
+    """Insert one log entry; the returned object is transient and needs no refresh."""
+    row = _with_client_defaults(models.LogEntry, log_entry.model_dump())
+    db.execute(models.LogEntry.__table__.insert(), [row])
+    record_log_side_tables(db, [row])
+    db.commit()
+    return models.LogEntry(**row)
+
+
+# Guard logging modes
+def sample_fraction(request_id: str) -> float:
+    """Map a request id to a stable value in [0, 1), the same in every worker."""
+    digest = hashlib.blake2b(request_id.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2**64
+
+
+def should_store_log(log_mode: str, sample_rate: Optional[float], request_id: str, flagged: bool) -> bool:
+    """Whether a guard decision gets a full log_entries row under the project's log mode."""
+    if log_mode == "counts_only":
+        return False
+    if flagged or log_mode == "full":
+        return True
+    if log_mode == "sampled":
+        return sample_fraction(request_id) < (sample_rate or 0.0)
+    return False  # threats_only
+
+
+class GuardDecision(NamedTuple):
+    """A guard decision ready to be written, now or later by the background writer."""
+    row: dict  # log_entries row, id and timestamp already set
+    stored: bool  # whether the project's log mode keeps a log_entries row
+    project_id: Optional[str] = None
+    api_key_id: Optional[str] = None
+
+
+def guard_decision(
+    log_entry: schemas.LogEntryCreate,
+    log_mode: str = "full",
+    sample_rate: Optional[float] = None,
+    project_id: Optional[str] = None,
+    api_key_id: Optional[str] = None,
+    policy_version: Optional[int] = None,
+) -> GuardDecision:
+    row = _with_client_defaults(models.LogEntry, log_entry.model_dump())
+    row["policy_version"] = policy_version
+    stored = should_store_log(log_mode, sample_rate, log_entry.request_id, bool(log_entry.threats_detected))
+    return GuardDecision(row, stored, project_id, api_key_id)
+
+
+def record_guard_decisions(db: Session, decisions: List[GuardDecision]) -> None:
+    """Write guard decisions in one transaction.
+
+    Every decision is counted in the activity rollups, stored ones are also
+    written to log_entries, and flagged ones (stored or not) queue detection
+    events for the project's webhooks. The decisions' API keys get ``last_used`` in the same
+    transaction, so a failed batch can be retried whole without counting twice.
+    """
+    stored = [d for d in decisions if d.stored]
+    if stored:
+        rows = [d.row for d in stored]
+        db.execute(models.LogEntry.__table__.insert(), rows)
+        record_log_side_tables(db, rows)
+    by_project: Dict[Optional[str], List[dict]] = defaultdict(list)
+    for d in decisions:
+        if d.row.get("threats_detected"):
+            # counts_only keeps no log row, so its events carry no log_id.
+            by_project[d.project_id].append(d.row if d.stored else dict(d.row, id=None))
+    for project_id, project_rows in by_project.items():
+        webhooks.enqueue_detections(db, project_id, project_rows)
+    record_activity(db, [d.row for d in decisions if not d.stored])
+    touch_api_keys_last_used(db, {d.api_key_id for d in decisions if d.api_key_id}, commit=False)
+    db.commit()
+
+
+def bulk_create_log_entries(
+    db: Session,
+    log_entries: Iterable[Union[schemas.LogEntryCreate, dict]],
+    commit: bool = True,
+) -> List[str]:
+    """Insert many log entries with one executemany and return their ids."""
+    rows = _prepare_rows(models.LogEntry, log_entries)
+    if rows:
+        db.execute(models.LogEntry.__table__.insert(), rows)
+        record_log_side_tables(db, rows)
+    if commit:
+        db.commit()
+    return [row["id"] for row in rows]
+
+
+def record_log_side_tables(db: Session, rows: List[dict]) -> None:
+    """Update everything derived from freshly inserted log rows (no commit)."""
+    record_activity(db, rows)
+    record_log_threats(db, rows)
+
+
+def delete_log_entries(db: Session, log_ids: List[str]) -> None:
+    """Delete log entries and their log_threats rows (no commit).
+
+    The rows are removed explicitly: SQLite only honours the ON DELETE CASCADE
+    on log_threats with PRAGMA foreign_keys=ON, which this app does not set.
+    """
+    db.query(models.LogThreat).filter(models.LogThreat.log_id.in_(log_ids)).delete(synchronize_session=False)
+    db.query(models.LogEntry).filter(models.LogEntry.id.in_(log_ids)).delete(synchronize_session=False)
+
+
+def record_log_threats(db: Session, rows: Iterable[dict]) -> None:
+    """Insert one log_threats row per (log, threat) pair (no commit)."""
+    threat_rows = [
+        {"log_id": row["id"], "threat": threat, "timestamp": row["timestamp"], "project": row["project"]}
+        for row in rows
+        for threat in set(row.get("threats_detected") or [])
+    ]
+    if threat_rows:
+        db.execute(models.LogThreat.__table__.insert(), threat_rows)
+
+
+# Bulk inserts
+@lru_cache(maxsize=None)
+def _client_default_columns(model) -> List[str]:
+    """Columns whose value is normally generated by the database or on refresh."""
+    return [
+        column.name
+        for column in model.__table__.columns
+        if column.primary_key or (column.server_default is not None and isinstance(column.type, DateTime))
+    ]
+
+
+def _with_client_defaults(model, row: dict, now: Optional[datetime] = None) -> dict:
+    """Fill ids and server-side timestamps client-side so no SELECT is needed after insert."""
+    now = now or datetime.now(timezone.utc)
+    for name in _client_default_columns(model):
+        if row.get(name) is None:
+            row[name] = str(uuid.uuid4()) if model.__table__.columns[name].primary_key else now
+    return row
+
+
+def _prepare_rows(model, rows: Iterable[Union[BaseModel, dict]]) -> List[dict]:
+    now = datetime.now(timezone.utc)
+    prepared = []
+    for row in rows:
+        data = row.model_dump() if isinstance(row, BaseModel) else dict(row)
+        prepared.append(_with_client_defaults(model, data, now))
+    return prepared
+
+
+def bulk_insert(
+    db: Session,
+    model,
+    rows: Iterable[Union[BaseModel, dict]],
+    commit: bool = True,
+) -> List[str]:
+    """Insert rows through Core ``insert()`` as a single executemany.
+
+    Rows may be Pydantic models or plain dicts. Ids and timestamps are generated
+    client-side, so the generated ids are returned without a refresh per row.
+    """
+    prepared = _prepare_rows(model, rows)
+    if prepared:
+        db.execute(model.__table__.insert(), prepared)
+        if model.__tablename__ in ("projects", "policies", "api_keys"):
+            invalidation.publish(db, model.__tablename__)
+    if commit:
+        db.commit()
+    return [row["id"] for row in prepared]
+
+
+# Column-only reads for list endpoints
+def select_rows(query) -> List[dict]:
+    """Run a column query and return plain dicts keyed by column name.
+
+    Skips ORM identity-map bookkeeping and per-row Pydantic validation; the
+    caller serializes the dicts directly.
+    """
+    keys = [column["name"] for column in query.column_descriptions]
+    return [dict(zip(keys, row)) for row in query.all()]
+
+
+def _schema_columns(model, schema) -> list:
+    """Model columns for the fields of a response schema, in schema field order."""
+    return [getattr(model, name) for name in schema.model_fields if name in model.__table__.columns]
+
+
+def get_project_rows(db: Session, skip: int = 0, limit: int = 100) -> List[dict]:
+    query = db.query(*_schema_columns(models.Project, schemas.Project)).offset(skip).limit(limit)
+    return select_rows(query)
+
+
+def get_policy_rows(db: Session, skip: int = 0, limit: int = 100) -> List[dict]:
+    query = db.query(*_schema_columns(models.Policy, schemas.Policy)).offset(skip).limit(limit)
+    return select_rows(query)
+
+
+def get_api_key_rows(db: Session, skip: int = 0, limit: int = 100) -> List[dict]:
+    query = db.query(*_schema_columns(models.ApiKey, schemas.ApiKey)).offset(skip).limit(limit)
+    return select_rows(query)
+
+
+def _utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def get_log_entry_rows(
+    db: Session,
+    skip: int = 0,
+    limit: int = 100,
+    project: Optional[str] = None,
+    threat: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> List[dict]:
+    """Newest log entries first, optionally filtered.
+
+    A ``threat`` filter is driven from the indexed log_threats table, so the
+    query is a range scan over (threat, project, timestamp) instead of
+    decoding ``threats_detected`` on every row.
+    """
+    since, until = _utc(since), _utc(until)
+    query = db.query(*_schema_columns(models.LogEntry, schemas.LogEntry))
+    if threat:
+        threats = models.LogThreat
+        query = query.select_from(threats).join(models.LogEntry, models.LogEntry.id == threats.log_id)
+        query = query.filter(threats.threat == threat)
+        if project:
+            query = query.filter(threats.project == project)
+        if since:
+            query = query.filter(threats.timestamp >= since)
+        if until:
+            query = query.filter(threats.timestamp < until)
+        query = query.order_by(threats.timestamp.desc())
+    else:
+        if project:
+            query = query.filter(models.LogEntry.project == project)
+        if since:
+            query = query.filter(models.LogEntry.timestamp >= since)
+        if until:
+            query = query.filter(models.LogEntry.timestamp < until)
+        query = query.order_by(models.LogEntry.timestamp.desc())
+    return select_rows(query.offset(skip).limit(limit))
+
+
+def search_log_entry_rows(
+    db: Session,
+    q: str,
+    skip: int = 0,
+    limit: int = 100,
+    project: Optional[str] = None,
+    threat: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> List[dict]:
+    """Full-text search over log content, best match first."""
+    columns = [models.LogEntry.__table__.c[name] for name in schemas.LogEntry.model_fields]
+    return search.search_log_entries(
+        db, columns, q, skip=skip, limit=limit, project=project, threat=threat, since=_utc(since), until=_utc(until)
+    )
+
+
+def get_threat_counts(
+    db: Session, since: datetime, project: Optional[str] = None
+) -> List[schemas.ThreatCount]:
+    """Per-threat log counts since ``since``, answered from the log_threats indexes."""
+    threats = models.LogThreat
+    query = db.query(threats.threat, func.count()).filter(threats.timestamp >= _utc(since))
+    if project:
+        query = query.filter(threats.project == project)
+    rows = query.group_by(threats.threat).order_by(func.count().desc()).all()
+    return [schemas.ThreatCount(threat=threat, count=count) for threat, count in rows]
+
+
+# Activity rollups for dashboard tiles
+ACTIVITY_BUCKET_SECONDS = 300
+ACTIVITY_WINDOWS = {"last_1h": 3600, "last_24h": 86400, "last_7d": 7 * 86400}
+
+
+def _upsert_statement(db: Session, table):
+    """Dialect-specific INSERT that supports ON CONFLICT DO UPDATE."""
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+
+def _epoch(value) -> float:
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    return time.time()
+
+
+def record_activity(db: Session, log_rows: Iterable[dict]) -> None:
+    """Add log rows to the per-project and per-policy counters (no commit)."""
+    counters: Dict[tuple, List[int]] = defaultdict(lambda: [0, 0])
+    for row in log_rows:
+        bucket = int(_epoch(row.get("timestamp"))) // ACTIVITY_BUCKET_SECONDS * ACTIVITY_BUCKET_SECONDS
+        flagged = 1 if row.get("threats_detected") else 0
+        for scope, name in (("project", row["project"]), ("policy", row["policy"])):
+            counter = counters[(scope, name, bucket)]
+            counter[0] += 1
+            counter[1] += flagged
+    if not counters:
+        return
+
+    table = models.ActivityRollup.__table__
+    stmt = _upsert_statement(db, table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.scope, table.c.name, table.c.bucket],
+        set_={
+            "requests": table.c.requests + stmt.excluded.requests,
+            "threats": table.c.threats + stmt.excluded.threats,
+        },
+    )
+    db.execute(
+        stmt,
+        [
+            {"scope": scope, "name": name, "bucket": bucket, "requests": requests, "threats": threats}
+            for (scope, name, bucket), (requests, threats) in counters.items()
+        ],
+    )
+
+
+def prune_activity(db: Session) -> None:
+    """Drop counter buckets older than the widest window."""
+    oldest = int(time.time()) - max(ACTIVITY_WINDOWS.values()) - ACTIVITY_BUCKET_SECONDS
+    db.query(models.ActivityRollup).filter(models.ActivityRollup.bucket <= oldest).delete(synchronize_session=False)
     db.commit()
-    db.refresh(db_log_entry)
-    return db_log_entry
+
+
+def get_activity(db: Session, scope: str, names: List[str]) -> Dict[str, schemas.ActivityStats]:
+    """Sliding-window counters for the given project or policy names.
+
+    Windows are resolved to ``ACTIVITY_BUCKET_SECONDS`` granularity, so each one
+    may include up to one extra bucket of older traffic.
+    """
+    if not names:
+        return {}
+    rollup = models.ActivityRollup
+    now = int(time.time())
+    columns = []
+    for seconds in ACTIVITY_WINDOWS.values():
+        in_window = rollup.bucket > now - seconds - ACTIVITY_BUCKET_SECONDS
+        columns.append(func.sum(case((in_window, rollup.requests), else_=0)))
+        columns.append(func.sum(case((in_window, rollup.threats), else_=0)))
+    oldest = now - max(ACTIVITY_WINDOWS.values()) - ACTIVITY_BUCKET_SECONDS
+    rows = (
+        db.query(rollup.name, *columns)
+        .filter(rollup.scope == scope, rollup.name.in_(set(names)), rollup.bucket > oldest)
+        .group_by(rollup.name)
+        .all()
+    )
+    stats = {}
+    for name, *values in rows:
+        windows = {
+            label: schemas.ActivityWindow(requests=values[2 * i] or 0, threats=values[2 * i + 1] or 0)
+            for i, label in enumerate(ACTIVITY_WINDOWS)
+        }
+        stats[name] = schemas.ActivityStats(**windows)
+    return stats
+
+
+def attach_activity(db: Session, scope: str, rows: List[dict]) -> List[dict]:
+    """Add an ``activity`` dict to each project or policy row for list responses."""
+    stats = get_activity(db, scope, [row["name"] for row in rows])
+    for row in rows:
+        row["activity"] = stats.get(row["name"], schemas.ActivityStats()).model_dump()
+    return rows
+
+
+# Token usage
+USAGE_BUCKET_SECONDS = 3600
+
+
+def record_token_usage(db: Session, counters: Dict[tuple, List[int]]) -> None:
+    """Add ``{(project_id, model, hour): [requests, prompt, completion]}`` to token_usage (no commit)."""
+    if not counters:
+        return
+    table = models.TokenUsage.__table__
+    stmt = _upsert_statement(db, table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.project_id, table.c.model, table.c.hour],
+        set_={
+            "requests": table.c.requests + stmt.excluded.requests,
+            "prompt_tokens": table.c.prompt_tokens + stmt.excluded.prompt_tokens,
+            "completion_tokens": table.c.completion_tokens + stmt.excluded.completion_tokens,
+        },
+    )
+    db.execute(
+        stmt,
+        [
+            {
+                "project_id": project_id,
+                "model": model,
+                "hour": hour,
+                "requests": requests,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+            }
+            for (project_id, model, hour), (requests, prompt_tokens, completion_tokens) in counters.items()
+        ],
+    )
+
+
+def get_token_totals(db: Session, project_ids: Iterable[str], since: int) -> Dict[str, int]:
+    """Prompt plus completion tokens per project since the ``since`` bucket."""
+    usage = models.TokenUsage
+    rows = (
+        db.query(usage.project_id, func.sum(usage.prompt_tokens + usage.completion_tokens))
+        .filter(usage.project_id.in_(set(project_ids)), usage.hour >= since)
+        .group_by(usage.project_id)
+        .all()
+    )
+    return {project_id: int(total or 0) for project_id, total in rows}
+
+
+def get_token_usage(db: Session, project_id: str, hours: int = 24) -> List[schemas.TokenUsage]:
+    """Hourly token usage per model for one project, oldest first."""
+    usage = models.TokenUsage
+    since = (int(time.time()) // USAGE_BUCKET_SECONDS - hours + 1) * USAGE_BUCKET_SECONDS
+    rows = (
+        db.query(usage.hour, usage.model, usage.requests, usage.prompt_tokens, usage.completion_tokens)
+        .filter(usage.project_id == project_id, usage.hour >= since)
+        .order_by(usage.hour, usage.model)
+        .all()
+    )
+    return [
+        schemas.TokenUsage(
+            hour=datetime.fromtimestamp(hour, timezone.utc),
+            model=model,
+            requests=requests,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+        )
+        for hour, model, requests, prompt_tokens, completion_tokens in rows
+    ]
 
 
 # API Key helpers for Guard v2
-def get_api_key_by_value(db: Session, key_value: str) -> Optional[models.ApiKey]:
-    return db.query(models.ApiKey).filter(models.ApiKey.key == key_value).first()
+class ApiKeyInfo(NamedTuple):
+    """What the guard path needs to know about a key, cached per worker.
+
+    Project settings come from the config snapshot, not from here.
+    """
+    id: str
+    project_id: Optional[str]
+
+
+# Keys are stored as a short lookup prefix ("lk_" plus 8 random characters)
+# and an HMAC-SHA256 of the whole key under API_KEY_PEPPER, which lives only
+# in the environment, so a database dump exposes no usable keys.
+API_KEY_PREFIX_LENGTH = 11
+_DEV_PEPPER = "leakguard-dev-pepper"
+# How long a prefix that matched no key is answered from memory.
+API_KEY_MISS_TTL_SECONDS = float(os.getenv("API_KEY_MISS_TTL_SECONDS", "5"))
+_API_KEY_MISS_LIMIT = 10000
+
+
+@lru_cache(maxsize=1)
+def api_key_pepper() -> bytes:
+    """The API key HMAC pepper; called at startup so a missing one fails fast.
+
+    The public development pepper is only used with DISABLE_AUTH=true or an
+    explicit API_KEY_ALLOW_DEV_PEPPER=true.
+    """
+    pepper = os.getenv("API_KEY_PEPPER")
+    if pepper:
+        return pepper.encode()
+    allow_dev = os.getenv("API_KEY_ALLOW_DEV_PEPPER", "false").lower() == "true"
+    if not (allow_dev or os.getenv("DISABLE_AUTH", "false").lower() == "true"):
+        raise RuntimeError(
+            "API_KEY_PEPPER is not set; set it to a long random secret "
+            "(or API_KEY_ALLOW_DEV_PEPPER=true for local development)"
+        )
+    logger.warning("API_KEY_PEPPER is not set; API keys are hashed with the development pepper")
+    return _DEV_PEPPER.encode()
+
+
+def hash_api_key(key_value: str) -> str:
+    return hmac.new(api_key_pepper(), key_value.encode(), hashlib.sha256).hexdigest()
+
+
+def mask_api_key(key_value: str) -> str:
+    """What list responses show instead of the key, e.g. ``lk_AbCdEfGh…wxyz``."""
+    return f"{key_value[:API_KEY_PREFIX_LENGTH]}…{key_value[-4:]}"
+
+
+def api_key_columns(key_value: str) -> dict:
+    """Column values stored for a plaintext key."""
+    return {
+        "key": mask_api_key(key_value),
+        "key_prefix": key_value[:API_KEY_PREFIX_LENGTH],
+        "key_hash": hash_api_key(key_value),
+    }
+
+
+# prefix -> [(hash digest, key info)] for every key, loaded on first use.
+_api_key_index: Optional[Dict[str, List[tuple]]] = None
+_api_key_index_generation = 0
+
+
+# prefix -> monotonic expiry, for prefixes the database had no key for.
+_api_key_misses: Dict[str, float] = {}
+
+
+def _invalidate_api_key_index(key: Optional[str] = None) -> None:
+    global _api_key_index, _api_key_index_generation
+    _api_key_index_generation += 1
+    _api_key_index = None
+    _api_key_misses.clear()
+
+
+invalidation.subscribe("api_keys", _invalidate_api_key_index)
+
+
+def _api_key_candidates(rows) -> List[tuple]:
+    return [(bytes.fromhex(key_hash), ApiKeyInfo(key_id, project_id)) for key_id, project_id, key_hash in rows]
+
+
+def _load_api_key_index(db: Session) -> Dict[str, List[tuple]]:
+    global _api_key_index
+    generation = _api_key_index_generation
+    index: Dict[str, List[tuple]] = defaultdict(list)
+    rows = db.query(
+        models.ApiKey.key_prefix, models.ApiKey.id, models.ApiKey.project_id, models.ApiKey.key_hash
+    ).filter(models.ApiKey.key_hash.isnot(None))
+    for prefix, *row in rows:
+        index[prefix].extend(_api_key_candidates([row]))
+    index = dict(index)
+    # Skip caching if an invalidation raced with the query above.
+    if generation == _api_key_index_generation:
+        _api_key_index = index
+    return index
 
 
-def touch_api_key_last_used(db: Session, api_key: models.ApiKey) -> None:
-    from datetime import datetime, timezone
-    api_key.last_used = datetime.now(timezone.utc)
-    db.add(api_key)
+def resolve_api_key(db: Session, key_value: str) -> Optional[ApiKeyInfo]:
+    """Verify a presented key against the per-worker prefix index.
+
+    The index holds every key's prefix and hash digest, so a lookup is one
+    HMAC plus a dict probe; digests are compared with ``hmac.compare_digest``
+    over all candidates of the prefix. A prefix missing from the index is
+    looked up in the database, so keys created in another worker work before
+    its invalidation arrives; a prefix the database doesn't know either is
+    not queried again for API_KEY_MISS_TTL_SECONDS.
+    """
+    prefix = key_value[:API_KEY_PREFIX_LENGTH]
+    digest = bytes.fromhex(hash_api_key(key_value))
+    index = _api_key_index
+    if index is None:
+        index = _load_api_key_index(db)
+    candidates = index.get(prefix)
+    if candidates is None:
+        now = time.monotonic()
+        if _api_key_misses.get(prefix, 0.0) > now:
+            return None
+        generation = _api_key_index_generation
+        candidates = _api_key_candidates(
+            db.query(models.ApiKey.id, models.ApiKey.project_id, models.ApiKey.key_hash)
+            .filter(models.ApiKey.key_prefix == prefix, models.ApiKey.key_hash.isnot(None))
+            .all()
+        )
+        if not candidates and generation == _api_key_index_generation:
+            if len(_api_key_misses) >= _API_KEY_MISS_LIMIT:
+                _api_key_misses.clear()
+            _api_key_misses[prefix] = now + API_KEY_MISS_TTL_SECONDS
+    match = None
+    for candidate_digest, info in candidates:
+        if hmac.compare_digest(candidate_digest, digest):
+            match = info
+    return match
+
+
+def touch_api_keys_last_used(db: Session, key_ids: Iterable[str], commit: bool = True) -> None:
+    key_ids = list(key_ids)
+    if not key_ids:
+        return
+    db.query(models.ApiKey).filter(models.ApiKey.id.in_(key_ids)).update(
+        {models.ApiKey.last_used: datetime.now(timezone.utc)}, synchronize_session=False
+    )
+    if commit:
+        db.commit()
+
+
+# Webhook subscriptions
+def get_webhooks(db: Session, project_id: str) -> List[models.WebhookSubscription]:
+    return (
+        db.query(models.WebhookSubscription)
+        .filter(models.WebhookSubscription.project_id == project_id)
+        .order_by(models.WebhookSubscription.created_at)
+        .all()
+    )
+
+
+def get_webhook_rows(db: Session, project_id: str) -> List[dict]:
+    """Subscriptions of a project with their pending and dead event counts."""
+    outbox = models.EventOutbox
+    counts = dict(
+        ((subscription_id, status), count)
+        for subscription_id, status, count in db.query(outbox.subscription_id, outbox.status, func.count())
+        .join(models.WebhookSubscription, models.WebhookSubscription.id == outbox.subscription_id)
+        .filter(models.WebhookSubscription.project_id == project_id)
+        .group_by(outbox.subscription_id, outbox.status)
+        .all()
+    )
+    rows = []
+    for webhook in get_webhooks(db, project_id):
+        row = schemas.Webhook.model_validate(webhook).model_dump()
+        row["pending_events"] = counts.get((webhook.id, "pending"), 0)
+        row["dead_events"] = counts.get((webhook.id, "dead"), 0)
+        rows.append(row)
+    return rows
+
+
+def create_webhook(db: Session, project_id: str, webhook: schemas.WebhookCreate) -> models.WebhookSubscription:
+    db_webhook = models.WebhookSubscription(project_id=project_id, **webhook.model_dump())
+    db.add(db_webhook)
+    db.flush()
+    invalidation.publish(db, "webhooks", db_webhook.id)
+    db.commit()
+    db.refresh(db_webhook)
+    return db_webhook
+
+
+def _delete_webhook_rows(db: Session, webhook: models.WebhookSubscription) -> None:
+    db.query(models.EventOutbox).filter(models.EventOutbox.subscription_id == webhook.id).delete(
+        synchronize_session=False
+    )
+    db.delete(webhook)
+    invalidation.publish(db, "webhooks", webhook.id)
+
+
+def delete_webhook(db: Session, project_id: str, webhook_id: str) -> bool:
+    db_webhook = (
+        db.query(models.WebhookSubscription)
+        .filter(models.WebhookSubscription.id == webhook_id, models.WebhookSubscription.project_id == project_id)
+        .first()
+    )
+    if not db_webhook:
+        return False
+    _delete_webhook_rows(db, db_webhook)
     db.commit()
+    return True
 
 
 def update_project_proxy_settings(db: Session, project_id: str, proxy_update: schemas.ProjectProxyUpdate) -> Optional[models.Project]:
@@ -199,6 +861,43 @@ def update_project_proxy_settings(db: Session, project_id: str, proxy_update: sc
         db_project.is_public = proxy_update.is_public
         db_project.proxy_slug = proxy_update.proxy_slug
         db_project.supported_llms = proxy_update.supported_llms or []
+        invalidation.publish(db, "projects", project_id)
         db.commit()
         db.refresh(db_project)
     return db_project
+
+
+# App settings
+def get_app_setting(db: Session, name: str) -> Optional[dict]:
+    row = db.query(models.AppSetting.value).filter(models.AppSetting.name == name).first()
+    return row.value if row else None
+
+
+def put_app_setting(db: Session, name: str, value: dict) -> None:
+    """Store a setting (no commit)."""
+    db.merge(models.AppSetting(name=name, value=value, updated_at=datetime.now(timezone.utc)))
+
+
+# Job leases
+def acquire_lease(db: Session, name: str, holder: str, seconds: float, now: Optional[float] = None) -> bool:
+    """Take (or extend) the named lease for ``seconds``; False while another holder's lease is unexpired."""
+    now = time.time() if now is None else now
+    Lease = models.JobLease
+    updated = (
+        db.query(Lease)
+        .filter(Lease.name == name, or_(Lease.leased_until < now, Lease.holder == holder))
+        .update({Lease.holder: holder, Lease.leased_until: now + seconds}, synchronize_session=False)
+    )
+    if updated:
+        db.commit()
+        return True
+    if db.query(Lease.name).filter(Lease.name == name).first() is not None:
+        db.commit()
+        return False
+    try:
+        db.add(Lease(name=name, holder=holder, leased_until=now + seconds))
+        db.commit()
+    except IntegrityError:
+        db.rollback()  # another worker created it first
+        return False
+    return True
@@ -1,12 +1,28 @@
-from sqlalchemy import create_engine
+import os
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./leakguard.db"
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./leakguard.db")
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+connect_args = {"check_same_thread": False} if SQLALCHEMY_DATABASE_URL.startswith("sqlite") else {}
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args=connect_args)
+
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        # Only takes effect on a new database file; lets retention purges return
+        # freed pages with PRAGMA incremental_vacuum instead of a full VACUUM.
+        dbapi_connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        # WAL lets readers in other worker processes proceed during writes.
+        dbapi_connection.execute("PRAGMA journal_mode=WAL")
+        dbapi_connection.execute("PRAGMA synchronous=NORMAL")
+        dbapi_connection.execute("PRAGMA busy_timeout=5000")
+
+def sqlite_path():
+    """File of the configured SQLite database, for the sqlite3 migration scripts; None for other databases."""
+    return engine.url.database if engine.dialect.name == "sqlite" else None
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
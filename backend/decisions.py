@@ -0,0 +1,185 @@
+"""Recent guard decisions in memory, and the background writer for async persistence.
+
+``/v2/guard`` accepts ``persist``:
+
+* ``sync`` (default): the decision is written before the response, as before.
+* ``async``: the decision is queued for ``BackgroundLogWriter``, which writes
+  queued decisions in batches with one transaction each. If the queue is full
+  the decision is dropped (counted in ``dropped``) rather than slowing the caller.
+* ``none``: no log entry; the decision is only queued for the activity rollups.
+
+The mode only applies to clean requests. Flagged decisions are always written
+synchronously, so a client cannot keep a detection out of the logs, rollups or
+webhooks. Each batch, including its API keys' ``last_used``, is one transaction;
+a batch the writer fails to commit is retried ``WRITE_ATTEMPTS``
+times with backoff before it is dropped and logged as an error.
+
+Every decision, whatever the mode, goes into a fixed-size ``RingBuffer`` per
+project for the live-tail view. Buffers live in each worker's memory, so a
+worker only lists the decisions it served.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+import crud
+
+logger = logging.getLogger(__name__)
+
+RECENT_SIZE = int(os.getenv("RECENT_DECISIONS_SIZE", "1000"))
+QUEUE_SIZE = int(os.getenv("GUARD_WRITE_QUEUE_SIZE", "10000"))
+BATCH_SIZE = int(os.getenv("GUARD_WRITE_BATCH_SIZE", "500"))
+FLUSH_SECONDS = float(os.getenv("GUARD_WRITE_FLUSH_SECONDS", "0.2"))
+WRITE_ATTEMPTS = int(os.getenv("GUARD_WRITE_ATTEMPTS", "5"))
+MAX_BACKOFF_SECONDS = 5.0
+
+PERSIST_MODES = ("sync", "async", "none")
+
+
+class RingBuffer:
+    """Fixed-capacity buffer over a preallocated list; the oldest entry is overwritten."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._items: List[Optional[dict]] = [None] * capacity
+        self._next = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def append(self, item: dict) -> None:
+        with self._lock:
+            self._items[self._next] = item
+            self._next = (self._next + 1) % self.capacity
+            if self._count < self.capacity:
+                self._count += 1
+
+    def latest(self, limit: Optional[int] = None) -> List[dict]:
+        """Up to ``limit`` entries, newest first."""
+        with self._lock:
+            count = self._count if limit is None else min(limit, self._count)
+            return [self._items[(self._next - 1 - i) % self.capacity] for i in range(count)]
+
+    def __len__(self) -> int:
+        return self._count
+
+
+class RecentDecisions:
+    """One ``RingBuffer`` per project id."""
+
+    def __init__(self, capacity: int = RECENT_SIZE):
+        self.capacity = capacity
+        self._buffers: Dict[str, RingBuffer] = {}
+        self._lock = threading.Lock()
+
+    def record(self, project_id: str, decision: dict) -> None:
+        buffer = self._buffers.get(project_id)
+        if buffer is None:
+            with self._lock:
+                buffer = self._buffers.setdefault(project_id, RingBuffer(self.capacity))
+        buffer.append(decision)
+
+    def latest(self, project_id: str, limit: Optional[int] = None) -> List[dict]:
+        buffer = self._buffers.get(project_id)
+        return buffer.latest(limit) if buffer is not None else []
+
+
+class BackgroundLogWriter:
+    """Writes queued guard decisions in batches on a daemon thread."""
+
+    def __init__(self, session_factory, batch_size: int = BATCH_SIZE, interval: float = FLUSH_SECONDS):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.interval = interval
+        self.dropped = 0
+        self._queue: "queue.Queue[crud.GuardDecision]" = queue.Queue(maxsize=QUEUE_SIZE)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, decision: "crud.GuardDecision") -> bool:
+        """Queue a decision without blocking; returns False if it was dropped."""
+        try:
+            self._queue.put_nowait(decision)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logger.warning("Guard write queue full; %d decisions dropped so far", self.dropped)
+            return False
+
+    def _take_batch(self, wait: Optional[float]) -> List["crud.GuardDecision"]:
+        """Up to ``batch_size`` decisions; with ``wait``, block for the first one
+        and then keep collecting until ``wait`` seconds have passed since it."""
+        try:
+            batch = [self._queue.get(timeout=wait) if wait else self._queue.get_nowait()]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + (wait or 0)
+        while len(batch) < self.batch_size:
+            try:
+                remaining = deadline - time.monotonic()
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def write(self, batch: List["crud.GuardDecision"]) -> None:
+        db: Session = self.session_factory()
+        try:
+            crud.record_guard_decisions(db, batch)
+        finally:
+            db.close()
+
+    def flush(self) -> int:
+        """Write everything queued right now; returns how many decisions were written."""
+        written = 0
+        while True:
+            batch = self._take_batch(None)
+            if not batch:
+                return written
+            if self.write_with_retry(batch):
+                written += len(batch)
+
+    def write_with_retry(self, batch: List["crud.GuardDecision"]) -> bool:
+        """Write a batch, retrying with backoff; after WRITE_ATTEMPTS failures it is dropped."""
+        for attempt in range(1, WRITE_ATTEMPTS + 1):
+            try:
+                self.write(batch)
+                return True
+            except Exception:
+                if attempt == WRITE_ATTEMPTS:
+                    self.dropped += len(batch)
+                    logger.exception(
+                        "Dropping %d guard decisions after %d failed writes", len(batch), attempt
+                    )
+                    return False
+                logger.warning(
+                    "Writing %d queued guard decisions failed (attempt %d of %d); retrying",
+                    len(batch), attempt, WRITE_ATTEMPTS, exc_info=True,
+                )
+                time.sleep(min(self.interval * 2 ** attempt, MAX_BACKOFF_SECONDS))
+        return False
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            batch = self._take_batch(self.interval)
+            if batch:
+                self.write_with_retry(batch)
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="guard-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Flushing queued guard decisions failed")
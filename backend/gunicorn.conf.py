@@ -0,0 +1,32 @@
+"""Gunicorn settings for running the API with several uvicorn worker processes.
+
+Run with:
+    gunicorn -c gunicorn.conf.py main:app
+
+WEB_CONCURRENCY sets the worker count (default: one per CPU core). Each
+worker keeps its own caches; config changes reach the others through the
+config_changes table (see invalidation.py).
+"""
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY") or multiprocessing.cpu_count())
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+graceful_timeout = 30
+keepalive = 5
+accesslog = "-"
+
+
+def on_starting(server):
+    """Create the schema once in the master so workers never race on CREATE TABLE."""
+    import models
+    import search
+    from database import engine
+
+    models.Base.metadata.create_all(bind=engine)
+    search.ensure_search_index(engine)
+    # Close the master's pooled connections so forked workers never share one.
+    engine.dispose()
+    os.environ["SKIP_SCHEMA_CHECK"] = "true"
@@ -0,0 +1,146 @@
+"""Cross-worker cache invalidation through a shared-database notification table.
+
+Config writes call ``publish`` in the same transaction as the change, which
+appends a row to ``config_changes``. Every worker runs a ``ChangeListener``
+that polls for rows newer than the last one it has seen and calls the
+callbacks subscribed to each topic, so a change reaches all workers within
+``INVALIDATION_POLL_SECONDS``. The publishing worker also dispatches locally
+right after its commit, so it reads its own writes immediately.
+"""
+import logging
+import os
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+import models
+
+logger = logging.getLogger(__name__)
+
+POLL_SECONDS = float(os.getenv("INVALIDATION_POLL_SECONDS", "1.0"))
+KEEP_SECONDS = 3600
+
+Callback = Callable[[Optional[str]], None]
+
+_subscribers: Dict[str, List[Callback]] = defaultdict(list)
+
+# Session.info key of the (topic, key) changes to dispatch when that session commits.
+_PENDING_KEY = "invalidation_pending"
+
+
+def subscribe(topic: str, callback: Callback) -> None:
+    """Call ``callback(key)`` whenever ``topic`` changes in any worker."""
+    _subscribers[topic].append(callback)
+
+
+def dispatch(topic: str, key: Optional[str] = None) -> None:
+    for callback in list(_subscribers.get(topic, ())):
+        try:
+            callback(key)
+        except Exception:
+            logger.exception("Invalidation callback for %s failed", topic)
+
+
+def _dispatch_pending(session: Session) -> None:
+    pending = session.info.get(_PENDING_KEY)
+    if pending:
+        changes = list(pending)
+        pending.clear()
+        for topic, key in changes:
+            dispatch(topic, key)
+
+
+def _discard_pending(session: Session) -> None:
+    pending = session.info.get(_PENDING_KEY)
+    if pending:
+        pending.clear()
+
+
+def publish(db: Session, topic: str, key: Optional[str] = None) -> None:
+    """Record a config change; it is broadcast once the caller commits.
+
+    A rollback discards the change and its pending local dispatch, so a later
+    unrelated commit on the same session does not broadcast it.
+    """
+    db.add(models.ConfigChange(topic=topic, key=key, created_at=datetime.now(timezone.utc)))
+    pending = db.info.get(_PENDING_KEY)
+    if pending is None:
+        pending = db.info[_PENDING_KEY] = []
+        event.listen(db, "after_commit", _dispatch_pending)
+        event.listen(db, "after_rollback", _discard_pending)
+    pending.append((topic, key))
+
+
+class ChangeListener:
+    """Polls ``config_changes`` on a daemon thread and dispatches new rows."""
+
+    def __init__(self, session_factory, interval: float = POLL_SECONDS):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.last_id = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _max_id(self, db: Session) -> int:
+        return db.query(func.max(models.ConfigChange.id)).scalar() or 0
+
+    def poll(self) -> int:
+        """Dispatch changes newer than the last seen id; returns how many were found."""
+        db = self.session_factory()
+        try:
+            rows = (
+                db.query(models.ConfigChange.id, models.ConfigChange.topic, models.ConfigChange.key)
+                .filter(models.ConfigChange.id > self.last_id)
+                .order_by(models.ConfigChange.id)
+                .all()
+            )
+        finally:
+            db.close()
+        for change_id, topic, key in rows:
+            dispatch(topic, key)
+            self.last_id = change_id
+        return len(rows)
+
+    def prune(self) -> None:
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=KEEP_SECONDS)
+        db = self.session_factory()
+        try:
+            # The newest row always stays: SQLite reuses the ids of deleted
+            # trailing rows, which would move ids (and config versions) backwards.
+            db.query(models.ConfigChange).filter(
+                models.ConfigChange.created_at < cutoff, models.ConfigChange.id < self._max_id(db)
+            ).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def _loop(self) -> None:
+        polls = 0
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+                polls += 1
+                if polls * self.interval >= KEEP_SECONDS:
+                    polls = 0
+                    self.prune()
+            except Exception:
+                logger.exception("Polling config_changes failed")
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        db = self.session_factory()
+        try:
+            # Everything already in the table predates this worker's caches.
+            self.last_id = self._max_id(db)
+        finally:
+            db.close()
+        self._thread = threading.Thread(target=self._loop, name="config-changes", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
@@ -0,0 +1,49 @@
+"""Request body size limits, enforced before the body is parsed.
+
+``BodySizeLimitMiddleware`` rejects a request with 413 when its
+``Content-Length`` is over the limit for its path, and stops reading a
+streamed (chunked) body as soon as it passes the limit, so an oversized
+request never reaches pydantic or the database.
+"""
+from typing import Dict
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+
+def _too_large(limit: int) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"Request body larger than {limit} bytes")
+
+
+class BodySizeLimitMiddleware:
+    """ASGI middleware limiting request bodies per exact path."""
+
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            error = _too_large(limit)
+            await JSONResponse({"detail": error.detail}, status_code=error.status_code)(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # FastAPI re-raises HTTPExceptions from body reading as responses.
+                    raise _too_large(limit)
+            return message
+
+        await self.app(scope, limited_receive, send)
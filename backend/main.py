@@ -1,18 +1,51 @@
-from fastapi import FastAPI, Depends, HTTPException, Header
+import time
+
+_import_started = time.perf_counter()
+
+from dotenv import load_dotenv
+
+# Before the app modules import, so DATABASE_URL and friends can come from .env.
+load_dotenv()
+
+from fastapi import FastAPI, Depends, HTTPException, Header, Response
 from uuid import uuid4
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy import text
 from sqlalchemy.orm import Session
 from typing import List
+from datetime import datetime, timedelta, timezone
+import logging
+import os
+import random
+import threading
 import typing
+import uuid
 
 import models
 import schemas
 import crud
-from database import engine, get_db
-from auth import verify_token
+import search
+import scanner
+import profiling
+import snapshot
+import tokens
+import webhooks
+import auth
+from database import engine, get_db, SessionLocal
+from retention import RetentionScheduler
+from invalidation import ChangeListener
+from webhooks import OutboxDispatcher
+from usage import UsageMeter
+from decisions import BackgroundLogWriter, RecentDecisions
+from auth import verify_token, require_admin
 from analytics_mocks import build_mock_response
+from responses import FastJSONResponse
+from limits import BodySizeLimitMiddleware
+
+logger = logging.getLogger(__name__)
 
-models.Base.metadata.create_all(bind=engine)
+# Set when something else (e.g. the gunicorn master) already created the schema.
+SKIP_SCHEMA_CHECK = os.getenv("SKIP_SCHEMA_CHECK", "false").lower() == "true"
 
 app = FastAPI(title="LeakGuard API", version="1.0.0")
 
@@ -24,12 +57,97 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(BodySizeLimitMiddleware, limits={"/v2/guard": scanner.MAX_BODY_BYTES})
+
+profiler = profiling.Profiler(engine)
+app.add_middleware(profiling.ProfilingMiddleware, profiler=profiler)
+
+retention_scheduler = RetentionScheduler(SessionLocal)
+change_listener = ChangeListener(SessionLocal)
+webhook_dispatcher = OutboxDispatcher(SessionLocal)
+usage_meter = UsageMeter(SessionLocal)
+guard_writer = BackgroundLogWriter(SessionLocal)
+recent_decisions = RecentDecisions()
+
+startup_state = {
+    "ready": False,
+    "import_ms": round((time.perf_counter() - _import_started) * 1000, 1),
+    "startup_ms": None,
+    "jwks_warm": False,
+}
+
+
+def _warm_jwks():
+    """Fetch Clerk's JWKS off the request path; verify_token retries on first use if this fails."""
+    try:
+        auth.get_jwks()
+        startup_state["jwks_warm"] = True
+    except Exception:
+        logger.warning("JWKS warm-up failed; it will be fetched on first authenticated request")
+
+
+@app.on_event("startup")
+def start_background_jobs():
+    started = time.perf_counter()
+    crud.api_key_pepper()  # refuse to start with the public development pepper
+    if not SKIP_SCHEMA_CHECK:
+        models.Base.metadata.create_all(bind=engine)
+        search.ensure_search_index(engine)
+    if not auth.auth_disabled():
+        threading.Thread(target=_warm_jwks, name="jwks-warmup", daemon=True).start()
+    # The first load may download BPE files; keep it off the request path.
+    threading.Thread(target=tokens.warm_up, name="tiktoken-warmup", daemon=True).start()
+    change_listener.start()
+    # After the listener has its starting point, so no change falls in between.
+    db = SessionLocal()
+    try:
+        profiler.load(db)
+    finally:
+        db.close()
+    retention_scheduler.start()
+    webhook_dispatcher.start()
+    usage_meter.start()
+    guard_writer.start()
+    startup_state["startup_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    startup_state["ready"] = True
+    logger.info(
+        "Startup completed in %sms (imports %sms)", startup_state["startup_ms"], startup_state["import_ms"]
+    )
+
+
+@app.on_event("shutdown")
+def stop_background_jobs():
+    retention_scheduler.stop()
+    change_listener.stop()
+    webhook_dispatcher.stop()
+    usage_meter.stop()
+    guard_writer.stop()
+
 
 @app.get("/")
 def read_root():
     return {"message": "LeakGuard API is running"}
 
 
+@app.get("/healthz")
+def liveness():
+    """Liveness: the process is up and serving requests."""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+def readiness():
+    """Readiness: startup finished and the database answers."""
+    if not startup_state["ready"]:
+        raise HTTPException(status_code=503, detail="Starting up")
+    try:
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+    except Exception:
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    return {"status": "ready", **startup_state}
+
+
 @app.post("/api/guard/run", response_model=List[schemas.GuardResult])
 def run_guard_api(
     request: schemas.GuardRequest,
@@ -54,48 +172,90 @@ def guard_v2(
         raise HTTPException(status_code=401, detail="Missing or invalid Authorization header")
 
     token = authorization.split(" ", 1)[1].strip()
-    api_key = crud.get_api_key_by_value(db, token)
+    api_key = crud.resolve_api_key(db, token)
     if not api_key:
         raise HTTPException(status_code=401, detail="Invalid API key")
 
-    content_items = [m.content for m in payload.messages if m.role == "user" and m.content]
-    content = content_items[0] if content_items else (payload.messages[0].content if payload.messages else "")
+    # Store what was scanned (every message, up to GUARD_MAX_CHARS), not just the first user message.
+    content = scanner.joined_text(m.content for m in payload.messages)
+    scan = scanner.scan(m.content for m in payload.messages)
 
-    project_name = api_key.project.name if getattr(api_key, "project", None) else "default"
-    policy_name = api_key.project.policy if getattr(api_key, "project", None) else "default"
+    config = snapshot.current(db)
+    project = config.projects.get(api_key.project_id)
+    project_name = project.name if project else "default"
+    policy_name = project.policy if project else "default"
     request_id = str(uuid4())
-    latency_ms = 50
+    latency_ms = max(1, round(scan.elapsed_ms))
     region = "us-east-1"
 
     log = schemas.LogEntryCreate(
         project=project_name,
-        threats_detected=["PII", "PromptInjection", "SecretsLeak", "Toxicity", "Jailbreak"],
+        threats_detected=scan.threats,
         content=content,
         policy=policy_name,
         request_id=request_id,
         latency=latency_ms,
         region=region,
     )
-    created = crud.create_log_entry(db, log)
-    crud.touch_api_key_last_used(db, api_key)
+    decision = crud.guard_decision(
+        log,
+        project.log_mode if project else "full",
+        project.log_sample_rate if project else None,
+        project_id=api_key.project_id,
+        api_key_id=api_key.id,
+        policy_version=config.version,
+    )
+    # Flagged decisions (including scans cut short, see scanner.INCOMPLETE_THREAT)
+    # are always written before responding; the client's persist mode only
+    # applies to clean traffic. With "none", a clean decision
+    # still updates the activity rollups through the background writer.
+    persist = "sync" if scan.threats else payload.persist
+    if persist == "sync":
+        crud.record_guard_decisions(db, [decision])
+        logged = decision.stored
+    elif persist == "async":
+        logged = guard_writer.submit(decision) and decision.stored
+    else:
+        guard_writer.submit(decision._replace(stored=False))
+        logged = False
+
+    row = decision.row
+    recent_decisions.record(api_key.project_id or "default", {
+        "id": row["id"] if logged else None,
+        "created_at": row["timestamp"],
+        "request_id": request_id,
+        "threats_detected": row["threats_detected"],
+        "content_preview": content[:200],
+        "latency": latency_ms,
+        "policy_version": config.version,
+        "persist": persist,
+    })
 
     return {
-        "id": created.id,
-        "created_at": created.timestamp,
+        "id": row["id"] if logged else None,
+        "created_at": row["timestamp"],
         "request_id": request_id,
-        "threats_detected": created.threats_detected,
+        "threats_detected": log.threats_detected,
+        "policy_version": config.version,
+        "logged": logged,
+        "scan": {
+            "scanned_chars": scan.scanned_chars,
+            "total_chars": scan.total_chars,
+            "truncated": scan.truncated,
+            "timed_out": scan.timed_out,
+        },
     }
 
 
 # Projects endpoints
-@app.get("/api/projects", response_model=List[schemas.Project])
+@app.get("/api/projects", response_model=List[schemas.Project], response_class=FastJSONResponse)
 def list_projects(
     skip: int = 0, 
     limit: int = 100, 
     db: Session = Depends(get_db),
     current_user: dict = Depends(verify_token)
 ):
-    return crud.get_projects(db, skip=skip, limit=limit)
+    return FastJSONResponse(crud.attach_activity(db, "project", crud.get_project_rows(db, skip=skip, limit=limit)))
 
 
 @app.get("/api/projects/{project_id}", response_model=schemas.Project)
@@ -143,15 +303,56 @@ def delete_project(
     return {"message": "Project deleted successfully"}
 
 
+# Webhook endpoints
+@app.get("/api/projects/{project_id}/webhooks", response_model=List[schemas.Webhook])
+def list_webhooks(
+    project_id: str,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(verify_token)
+):
+    if not crud.get_project(db, project_id):
+        raise HTTPException(status_code=404, detail="Project not found")
+    return crud.get_webhook_rows(db, project_id)
+
+
+@app.post("/api/projects/{project_id}/webhooks", response_model=schemas.Webhook)
+def create_webhook(
+    project_id: str,
+    webhook: schemas.WebhookCreate,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(verify_token)
+):
+    """Subscribe an endpoint (or file:// event log) to the project's detection events"""
+    if not crud.get_project(db, project_id):
+        raise HTTPException(status_code=404, detail="Project not found")
+    try:
+        webhooks.check_target(webhook.target_url)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return crud.create_webhook(db, project_id, webhook)
+
+
+@app.delete("/api/projects/{project_id}/webhooks/{webhook_id}")
+def delete_webhook(
+    project_id: str,
+    webhook_id: str,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(verify_token)
+):
+    if not crud.delete_webhook(db, project_id, webhook_id):
+        raise HTTPException(status_code=404, detail="Webhook not found")
+    return {"message": "Webhook deleted successfully"}
+
+
 # Policies endpoints
-@app.get("/api/policies", response_model=List[schemas.Policy])
+@app.get("/api/policies", response_model=List[schemas.Policy], response_class=FastJSONResponse)
 def list_policies(
     skip: int = 0, 
     limit: int = 100, 
     db: Session = Depends(get_db),
     current_user: dict = Depends(verify_token)
 ):
-    return crud.get_policies(db, skip=skip, limit=limit)
+    return FastJSONResponse(crud.attach_activity(db, "policy", crud.get_policy_rows(db, skip=skip, limit=limit)))
 
 
 @app.get("/api/policies/{policy_id}", response_model=schemas.Policy)
@@ -200,14 +401,14 @@ def delete_policy(
 
 
 # API Keys endpoints
-@app.get("/api/api-keys", response_model=List[schemas.ApiKey])
+@app.get("/api/api-keys", response_model=List[schemas.ApiKey], response_class=FastJSONResponse)
 def list_api_keys(
     skip: int = 0, 
     limit: int = 100, 
     db: Session = Depends(get_db),
     current_user: dict = Depends(verify_token)
 ):
-    return crud.get_api_keys(db, skip=skip, limit=limit)
+    return FastJSONResponse(crud.get_api_key_rows(db, skip=skip, limit=limit))
 
 
 @app.post("/api/api-keys", response_model=schemas.ApiKey)
@@ -230,14 +431,31 @@ def delete_api_key(
     return {"message": "API Key deleted successfully"}
 
 # Log Entries endpoints
-@app.get("/api/logs", response_model=List[schemas.LogEntry])
+@app.get("/api/logs", response_model=List[schemas.LogEntry], response_class=FastJSONResponse)
 def list_log_entries(
     skip: int = 0,
     limit: int = 100,
+    q: typing.Optional[str] = None,
+    project: typing.Optional[str] = None,
+    threat: typing.Optional[str] = None,
+    since: typing.Optional[datetime] = None,
+    until: typing.Optional[datetime] = None,
     db: Session = Depends(get_db),
     current_user: dict = Depends(verify_token)
 ):
-    return crud.get_log_entries(db, skip=skip, limit=limit)
+    """List log entries, newest first, or full-text search their content with ``q`` (best match first).
+
+    ``project``, ``threat`` and ``since``/``until`` filter both modes.
+    """
+    if q:
+        rows = crud.search_log_entry_rows(
+            db, q, skip=skip, limit=limit, project=project, threat=threat, since=since, until=until
+        )
+    else:
+        rows = crud.get_log_entry_rows(
+            db, skip=skip, limit=limit, project=project, threat=threat, since=since, until=until
+        )
+    return FastJSONResponse(rows)
 
 
 @app.post("/api/logs", response_model=schemas.LogEntry)
@@ -248,6 +466,16 @@ def create_log_entry(
 ):
     return crud.create_log_entry(db, log_entry)
 
+
+@app.post("/api/logs/bulk")
+def create_log_entries_bulk(
+    log_entries: List[schemas.LogEntryCreate],
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(verify_token)
+):
+    """Import many log entries in one insert; returns the generated ids."""
+    return {"ids": crud.bulk_create_log_entries(db, log_entries)}
+
 @app.get("/api/analytics", response_model=schemas.AnalyticsResponse)
 def get_analytics(
     current_user: dict = Depends(verify_token)
@@ -255,6 +483,37 @@ def get_analytics(
     return build_mock_response()
 
 
+@app.get("/api/analytics/threats", response_model=List[schemas.ThreatCount])
+def get_threat_analytics(
+    days: int = 7,
+    project: typing.Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(verify_token)
+):
+    """Number of logged requests per threat type over the last ``days`` days."""
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+    return crud.get_threat_counts(db, since, project=project)
+
+
+@app.post("/api/retention/run")
+def run_retention(
+    current_user: dict = Depends(require_admin)
+):
+    """Purge expired logs now instead of waiting for the scheduler (admins only)."""
+    return {"deleted": retention_scheduler.run_once()}
+
+
+# Recent guard decisions endpoint
+@app.get("/api/projects/{project_id}/decisions")
+def list_recent_decisions(
+    project_id: str,
+    limit: int = 100,
+    current_user: dict = Depends(verify_token)
+):
+    """Latest /v2/guard decisions of a project served by this worker, newest first (no database)"""
+    return FastJSONResponse(recent_decisions.latest(project_id, limit))
+
+
 # Proxy endpoints
 @app.put("/api/projects/{project_id}/proxy", response_model=schemas.Project)
 def update_project_proxy(
@@ -291,10 +550,7 @@ def llm_chat(
     db: Session = Depends(get_db)
 ):
     """Mock LLM chat endpoint (no auth required, but project must be public)"""
-    import random
-    import uuid
-    
-    db_project = crud.get_project_by_slug(db, slug)
+    db_project = snapshot.current(db).projects_by_slug.get(slug)
     if not db_project:
         raise HTTPException(status_code=404, detail="Proxy not found")
     if not db_project.is_public:
@@ -314,6 +570,10 @@ def llm_chat(
         raise HTTPException(status_code=400, detail="No user message found")
     
     user_prompt = user_messages[-1].content
+
+    prompt_tokens = tokens.count_chat_tokens(request.model, request.messages)
+    if not usage_meter.has_quota(db, db_project.id, db_project.daily_token_quota, prompt_tokens):
+        raise HTTPException(status_code=429, detail="Daily token quota exceeded for this project")
     
     # Generate mock response based on model
     mock_responses = {
@@ -343,10 +603,9 @@ def llm_chat(
     model_responses = mock_responses.get(request.model, mock_responses["gpt-4"])
     response_content = random.choice(model_responses)
     
-    # Simulate some randomness in token usage
-    prompt_tokens = len(user_prompt.split()) * 1.3  # Rough estimate
-    completion_tokens = len(response_content.split()) * 1.3
-    total_tokens = int(prompt_tokens + completion_tokens)
+    completion_tokens = tokens.count_tokens(request.model, response_content)
+    total_tokens = prompt_tokens + completion_tokens
+    usage_meter.record(db_project.id, request.model, prompt_tokens, completion_tokens)
     
     return {
         "id": f"chatcmpl-{uuid.uuid4().hex[:29]}",
@@ -362,8 +621,89 @@ def llm_chat(
             }
         ],
         "usage": {
-            "prompt_tokens": int(prompt_tokens),
-            "completion_tokens": int(completion_tokens),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
             "total_tokens": total_tokens
         }
     }
+
+
+# Token usage endpoints
+@app.get("/api/projects/{project_id}/usage", response_model=List[schemas.TokenUsage])
+def get_project_usage(
+    project_id: str,
+    hours: int = 24,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(verify_token)
+):
+    """Hourly proxy token usage per model (flushed every USAGE_FLUSH_SECONDS)"""
+    if not crud.get_project(db, project_id):
+        raise HTTPException(status_code=404, detail="Project not found")
+    return crud.get_token_usage(db, project_id, hours=hours)
+
+
+# Admin profiling endpoints
+@app.get("/api/admin/profiling")
+def get_profiling(current_user: dict = Depends(require_admin)):
+    """Profiling settings and the number of profiles kept by this worker"""
+    return profiler.status()
+
+
+@app.put("/api/admin/profiling")
+def set_profiling(
+    settings: schemas.ProfilingSettings,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(require_admin)
+):
+    """Enable or disable request profiling in all workers"""
+    profiler.publish(db, profiling.Settings(
+        enabled=settings.enabled,
+        sample_rate=settings.sample_rate,
+        paths=tuple(settings.paths),
+        until=time.time() + settings.duration_seconds if settings.enabled else 0.0,
+    ))
+    db.commit()
+    return profiler.status()
+
+
+@app.get("/api/admin/profiles")
+def list_profiles(
+    path: typing.Optional[str] = None,
+    limit: int = 50,
+    current_user: dict = Depends(require_admin)
+):
+    """Summaries of this worker's profiled requests, newest first"""
+    return FastJSONResponse([profile.summary() for profile in profiler.profiles(path)[:limit]])
+
+
+@app.get("/api/admin/profiles/download")
+def download_profiles(
+    format: typing.Literal["collapsed", "speedscope"] = "speedscope",
+    path: typing.Optional[str] = None,
+    profile_id: typing.Optional[str] = None,
+    current_user: dict = Depends(require_admin)
+):
+    """This worker's profiles as collapsed stacks or a speedscope file"""
+    profiles = profiler.profiles(path, profile_id)
+    if profile_id and not profiles:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "collapsed":
+        return Response(
+            profiling.collapsed(profiles),
+            media_type="text/plain",
+            headers={"Content-Disposition": 'attachment; filename="leakguard-profile.folded"'},
+        )
+    return FastJSONResponse(
+        profiling.speedscope(profiles, profiler.interval_ms),
+        headers={"Content-Disposition": 'attachment; filename="leakguard-profile.speedscope.json"'},
+    )
+
+
+@app.delete("/api/admin/profiles")
+def clear_profiles(current_user: dict = Depends(require_admin)):
+    """Drop this worker's kept profiles"""
+    return {"deleted": profiler.clear()}
+
+
+# After every route is declared, so all sync endpoints are wrapped.
+profiling.instrument_routes(app)
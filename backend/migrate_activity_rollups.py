@@ -0,0 +1,48 @@
+"""
+Migration script to create the activity_rollups table and backfill it from
+existing log entries. Run this once after upgrading; new logs are counted
+automatically on ingestion.
+"""
+from database import SessionLocal, engine
+import models
+import crud
+
+BATCH_SIZE = 50000
+
+
+def migrate():
+    """Rebuild the per-project and per-policy counters from log_entries."""
+    models.Base.metadata.create_all(bind=engine, tables=[models.ActivityRollup.__table__])
+
+    db = SessionLocal()
+    try:
+        db.query(models.ActivityRollup).delete()
+        columns = (
+            models.LogEntry.timestamp,
+            models.LogEntry.project,
+            models.LogEntry.policy,
+            models.LogEntry.threats_detected,
+        )
+        batch = []
+        total = 0
+        for timestamp, project, policy, threats in db.query(*columns).yield_per(BATCH_SIZE):
+            batch.append({"timestamp": timestamp, "project": project, "policy": policy, "threats_detected": threats})
+            if len(batch) >= BATCH_SIZE:
+                crud.record_activity(db, batch)
+                total += len(batch)
+                batch = []
+        crud.record_activity(db, batch)
+        total += len(batch)
+        db.commit()
+        print(f"✓ Backfilled activity counters from {total} log entries")
+    except Exception as e:
+        db.rollback()
+        print(f"Error during migration: {e}")
+        raise
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    print("Running database migration...")
+    migrate()
@@ -0,0 +1,69 @@
+"""
+Migration script to stop storing API keys in plaintext.
+Adds the key_prefix and key_hash columns, fills them from every existing key
+and replaces the stored key with its masked form. Existing keys keep working.
+
+Set API_KEY_PEPPER (environment or .env) to the value the server uses before
+running this; keys hashed under a different pepper will no longer verify.
+"""
+import sqlite3
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from crud import api_key_columns  # noqa: E402  (reads API_KEY_PEPPER)
+from database import sqlite_path  # noqa: E402  (reads DATABASE_URL)
+
+DB_PATH = sqlite_path()
+
+def migrate():
+    """Hash plaintext API keys in place."""
+    if DB_PATH is None:
+        print("DATABASE_URL is not a SQLite database; this script only migrates SQLite files.")
+        return
+    if not os.path.exists(DB_PATH):
+        print(f"Database {DB_PATH} not found. It will be created on first run.")
+        return
+
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("PRAGMA table_info(api_keys)")
+        columns = [row[1] for row in cursor.fetchall()]
+
+        for name in ("key_prefix", "key_hash"):
+            if name not in columns:
+                print(f"Adding {name} column...")
+                cursor.execute(f"ALTER TABLE api_keys ADD COLUMN {name} VARCHAR")
+                print(f"✓ Added {name} column")
+            else:
+                print(f"✓ {name} column already exists")
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_api_keys_key_prefix ON api_keys (key_prefix)")
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_api_keys_key_hash ON api_keys (key_hash)")
+
+        cursor.execute("SELECT id, key FROM api_keys WHERE key_hash IS NULL")
+        rows = cursor.fetchall()
+        for key_id, key in rows:
+            values = api_key_columns(key)
+            cursor.execute(
+                "UPDATE api_keys SET key = ?, key_prefix = ?, key_hash = ? WHERE id = ?",
+                (values["key"], values["key_prefix"], values["key_hash"], key_id),
+            )
+        print(f"✓ Hashed {len(rows)} API keys")
+
+        conn.commit()
+        print("\nMigration completed successfully!")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Error during migration: {e}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    print("Running database migration...")
+    migrate()
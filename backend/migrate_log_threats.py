@@ -0,0 +1,50 @@
+"""
+Migration script to create the log_threats table and backfill it from the
+threats_detected column of existing log entries. Run this once after
+upgrading; new logs are indexed automatically on insert.
+"""
+from database import SessionLocal, engine
+import models
+import crud
+
+BATCH_SIZE = 50000
+
+
+def migrate():
+    """Rebuild log_threats from log_entries.threats_detected."""
+    models.Base.metadata.create_all(bind=engine, tables=[models.LogThreat.__table__])
+
+    db = SessionLocal()
+    try:
+        db.query(models.LogThreat).delete()
+        columns = (
+            models.LogEntry.id,
+            models.LogEntry.timestamp,
+            models.LogEntry.project,
+            models.LogEntry.threats_detected,
+        )
+        batch = []
+        total = 0
+        for log_id, timestamp, project, threats in db.query(*columns).yield_per(BATCH_SIZE):
+            if not threats:
+                continue
+            batch.append({"id": log_id, "timestamp": timestamp, "project": project, "threats_detected": threats})
+            if len(batch) >= BATCH_SIZE:
+                crud.record_log_threats(db, batch)
+                total += len(batch)
+                batch = []
+        crud.record_log_threats(db, batch)
+        total += len(batch)
+        db.commit()
+        print(f"✓ Backfilled log_threats for {total} flagged log entries")
+    except Exception as e:
+        db.rollback()
+        print(f"Error during migration: {e}")
+        raise
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    print("Running database migration...")
+    migrate()
@@ -0,0 +1,52 @@
+"""
+Migration script to add the policy_version column to the log_entries table.
+Run this once to update your existing database schema; older log entries keep
+a NULL version.
+"""
+import sqlite3
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from database import sqlite_path  # noqa: E402  (reads DATABASE_URL)
+
+DB_PATH = sqlite_path()
+
+def migrate():
+    """Add policy_version to log_entries if it doesn't exist."""
+    if DB_PATH is None:
+        print("DATABASE_URL is not a SQLite database; this script only migrates SQLite files.")
+        return
+    if not os.path.exists(DB_PATH):
+        print(f"Database {DB_PATH} not found. It will be created on first run.")
+        return
+
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("PRAGMA table_info(log_entries)")
+        columns = [row[1] for row in cursor.fetchall()]
+
+        if 'policy_version' not in columns:
+            print("Adding policy_version column...")
+            cursor.execute("ALTER TABLE log_entries ADD COLUMN policy_version INTEGER")
+            print("✓ Added policy_version column")
+        else:
+            print("✓ policy_version column already exists")
+
+        conn.commit()
+        print("\nMigration completed successfully!")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Error during migration: {e}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    print("Running database migration...")
+    migrate()
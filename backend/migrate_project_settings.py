@@ -0,0 +1,87 @@
+"""
+Migration script for per-project settings (log retention, guard log mode, token quota).
+Adds the new project columns and the log_entries timestamp indexes.
+
+Optionally switches an existing SQLite file to incremental auto-vacuum so
+retention purges can return freed pages without a full VACUUM. This runs one
+VACUUM (slow on large files) and rebuilds the search index:
+    python migrate_project_settings.py --enable-incremental-vacuum
+"""
+import sqlite3
+import os
+import sys
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from database import sqlite_path  # noqa: E402  (reads DATABASE_URL)
+
+DB_PATH = sqlite_path()
+
+PROJECT_COLUMNS = {
+    "retention_days": "INTEGER",
+    "log_mode": "VARCHAR NOT NULL DEFAULT 'full'",
+    "log_sample_rate": "FLOAT",
+    "daily_token_quota": "INTEGER",
+}
+
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_log_entries_timestamp ON log_entries (timestamp)",
+    "CREATE INDEX IF NOT EXISTS ix_log_entries_project_timestamp ON log_entries (project, timestamp)",
+]
+
+
+def migrate(enable_incremental_vacuum=False):
+    """Add missing project columns and log indexes."""
+    if DB_PATH is None:
+        print("DATABASE_URL is not a SQLite database; this script only migrates SQLite files.")
+        return
+    if not os.path.exists(DB_PATH):
+        print(f"Database {DB_PATH} not found. It will be created on first run.")
+        return
+
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("PRAGMA table_info(projects)")
+        columns = [row[1] for row in cursor.fetchall()]
+
+        for name, sql_type in PROJECT_COLUMNS.items():
+            if name not in columns:
+                print(f"Adding {name} column...")
+                cursor.execute(f"ALTER TABLE projects ADD COLUMN {name} {sql_type}")
+                print(f"✓ Added {name} column")
+            else:
+                print(f"✓ {name} column already exists")
+
+        for statement in INDEXES:
+            cursor.execute(statement)
+        print("✓ Log indexes present")
+
+        conn.commit()
+
+        if enable_incremental_vacuum:
+            print("Enabling incremental auto-vacuum (runs VACUUM)...")
+            cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            cursor.execute("VACUUM")
+            # VACUUM may renumber rowids, which the FTS index is keyed on.
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'log_entries_fts'")
+            if cursor.fetchone():
+                cursor.execute("INSERT INTO log_entries_fts(log_entries_fts) VALUES ('rebuild')")
+            conn.commit()
+            print("✓ Incremental auto-vacuum enabled")
+
+        print("\nMigration completed successfully!")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Error during migration: {e}")
+        raise
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    print("Running database migration...")
+    migrate(enable_incremental_vacuum="--enable-incremental-vacuum" in sys.argv[1:])
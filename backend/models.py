@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, Integer, Text, JSON, ForeignKey, Boolean
+from sqlalchemy import Column, String, DateTime, Integer, Float, Text, JSON, ForeignKey, Boolean, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from database import Base
@@ -16,6 +16,10 @@ class Project(Base):
     is_public = Column(Boolean, nullable=False, default=False)
     proxy_slug = Column(String, unique=True, nullable=True)
     supported_llms = Column(JSON, nullable=True, default=list)
+    retention_days = Column(Integer, nullable=True)  # None: LOG_RETENTION_DAYS or keep forever
+    log_mode = Column(String, nullable=False, default="full")  # full | threats_only | sampled | counts_only
+    log_sample_rate = Column(Float, nullable=True)  # share of clean requests kept in "sampled" mode
+    daily_token_quota = Column(Integer, nullable=True)  # proxy tokens per UTC day; None: unlimited
 
 class Policy(Base):
     __tablename__ = "policies"
@@ -34,7 +38,9 @@ class ApiKey(Base):
 
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     name = Column(String, nullable=False)
-    key = Column(String, unique=True, nullable=False)
+    key = Column(String, unique=True, nullable=False)  # masked for display; the plaintext is never stored
+    key_prefix = Column(String, nullable=True, index=True)  # "lk_" + 8 characters, narrows verification
+    key_hash = Column(String, unique=True, nullable=True)  # HMAC-SHA256 under API_KEY_PEPPER
     # optional link to a Project
     project_id = Column(String, ForeignKey("projects.id"), nullable=True)
     project = relationship("Project", backref="api_keys")
@@ -54,3 +60,111 @@ class LogEntry(Base):
     latency = Column(Integer, nullable=False)
     region = Column(String, nullable=False)
     log_entry_metadata = Column(String)
+    policy_version = Column(Integer, nullable=True)  # config snapshot version that made the decision
+
+    __table_args__ = (
+        Index("ix_log_entries_timestamp", "timestamp"),
+        Index("ix_log_entries_project_timestamp", "project", "timestamp"),
+    )
+
+
+class LogThreat(Base):
+    """One row per threat detected in a log entry, so threat filters use an index."""
+    __tablename__ = "log_threats"
+
+    # The cascade needs PRAGMA foreign_keys=ON on SQLite; crud.delete_log_entries removes these rows itself.
+    log_id = Column(String, ForeignKey("log_entries.id", ondelete="CASCADE"), primary_key=True)
+    threat = Column(String, primary_key=True)
+    timestamp = Column(DateTime(timezone=True), nullable=False)
+    project = Column(String, nullable=False)
+
+    __table_args__ = (
+        Index("ix_log_threats_threat_project_timestamp", "threat", "project", "timestamp"),
+        Index("ix_log_threats_threat_timestamp", "threat", "timestamp"),
+    )
+
+
+class ActivityRollup(Base):
+    """Request and threat counters per project or policy in fixed time buckets."""
+    __tablename__ = "activity_rollups"
+
+    scope = Column(String, primary_key=True)  # "project" or "policy"
+    name = Column(String, primary_key=True)
+    bucket = Column(Integer, primary_key=True)  # bucket start, unix seconds
+    requests = Column(Integer, nullable=False, default=0)
+    threats = Column(Integer, nullable=False, default=0)
+
+
+class TokenUsage(Base):
+    """Proxy prompt and completion tokens per project and model in hourly buckets."""
+    __tablename__ = "token_usage"
+
+    project_id = Column(String, primary_key=True)
+    model = Column(String, primary_key=True)
+    hour = Column(Integer, primary_key=True)  # bucket start, unix seconds
+    requests = Column(Integer, nullable=False, default=0)
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+
+
+class ConfigChange(Base):
+    """Append-only feed of config writes that other workers poll to invalidate caches."""
+    __tablename__ = "config_changes"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    topic = Column(String, nullable=False)
+    key = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+
+class WebhookSubscription(Base):
+    """A project's detection event sink: an http(s) endpoint or a local file:// event log."""
+    __tablename__ = "webhook_subscriptions"
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    project_id = Column(String, ForeignKey("projects.id", ondelete="CASCADE"), nullable=False, index=True)
+    target_url = Column(String, nullable=False)
+    secret = Column(String, nullable=True)  # plaintext: signing needs it (X-LeakGuard-Signature); never returned
+    include_content = Column(Boolean, nullable=False, default=False)
+    is_active = Column(Boolean, nullable=False, default=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    leased_until = Column(Float, nullable=True)  # unix seconds; one worker delivers at a time
+
+
+class EventOutbox(Base):
+    """Detection events awaiting delivery, written in the same transaction as the log entry.
+
+    Rows are delivered in id order per subscription and deleted once accepted;
+    rows that keep failing end up with status "dead".
+    """
+    __tablename__ = "event_outbox"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    subscription_id = Column(String, ForeignKey("webhook_subscriptions.id", ondelete="CASCADE"), nullable=False)
+    payload = Column(JSON, nullable=False)
+    status = Column(String, nullable=False, default="pending")  # pending | dead
+    attempts = Column(Integer, nullable=False, default=0)
+    available_at = Column(Float, nullable=False)  # unix seconds; pushed back after a failed attempt
+    last_error = Column(String, nullable=True)
+
+    __table_args__ = (
+        Index("ix_event_outbox_subscription_status_id", "subscription_id", "status", "id"),
+    )
+
+
+class JobLease(Base):
+    """Which worker runs a periodic job, so it runs in one worker at a time."""
+    __tablename__ = "job_leases"
+
+    name = Column(String, primary_key=True)
+    holder = Column(String, nullable=False)
+    leased_until = Column(Float, nullable=False)  # unix seconds
+
+
+class AppSetting(Base):
+    """Runtime settings changed through the API, read by every worker at startup."""
+    __tablename__ = "app_settings"
+
+    name = Column(String, primary_key=True)
+    value = Column(JSON, nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False)
@@ -0,0 +1,427 @@
+"""On-demand request profiling: sampled stacks and per-request SQL accounting.
+
+Profiling is off until an admin enables it, and it switches itself off again
+after ``duration_seconds``. Settings are stored in ``app_settings``, which each
+worker reads at startup, and changes travel through ``invalidation`` (topic
+``profiling``), so running workers apply them within a poll interval. While
+enabled, ``ProfilingMiddleware`` picks ``sample_rate`` of the requests whose
+path starts with one of ``paths`` (all requests when empty). For those:
+
+* a sampler thread reads the endpoint thread's stack from
+  ``sys._current_frames()`` every ``PROFILE_INTERVAL_MS``. It only runs while a
+  sampled request is in flight, and unsampled requests pay one random draw;
+* every SQL statement is counted and timed through engine cursor events.
+  Statements run ``PROFILE_REPEAT_THRESHOLD`` or more times in one request are
+  logged as a likely N+1.
+
+The last ``PROFILE_KEEP`` profiles stay in each worker's memory and can be
+exported as collapsed stacks (flamegraph.pl, speedscope, inferno) or as a
+speedscope JSON file. Like the recent-decisions buffer, a worker only holds the
+requests it served.
+"""
+import asyncio
+import functools
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextvars import ContextVar
+from typing import Deque, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import crud
+import invalidation
+
+logger = logging.getLogger(__name__)
+
+INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+KEEP_PROFILES = int(os.getenv("PROFILE_KEEP", "200"))
+REPEAT_THRESHOLD = int(os.getenv("PROFILE_REPEAT_THRESHOLD", "5"))
+MAX_STACK_DEPTH = 128
+
+# The profiling endpoints themselves are never profiled.
+EXCLUDED_PREFIX = "/api/admin/"
+
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+
+Frame = Tuple[str, str, int]  # function, file, first line
+Stack = Tuple[Frame, ...]  # outermost first
+
+
+SETTINGS_NAME = "profiling"  # app_settings row
+
+
+class Settings(NamedTuple):
+    enabled: bool = False
+    sample_rate: float = 0.0
+    paths: Tuple[str, ...] = ()
+    until: float = 0.0  # epoch seconds; profiling stops after this
+
+    def active(self, now: float) -> bool:
+        return self.enabled and self.sample_rate > 0 and now < self.until
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Settings":
+        return cls(**{**data, "paths": tuple(data.get("paths") or ())})
+
+
+class RequestProfile:
+    """Samples and SQL timings of one request."""
+
+    def __init__(self, method: str, path: str):
+        self.id = uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.status: Optional[int] = None
+        self.started_at = time.time()
+        self.duration_ms = 0.0
+        self.threads = set()
+        self.stacks: Counter = Counter()
+        self.sql_count = 0
+        self.sql_ms = 0.0
+        # statement -> [executions, total ms]
+        self.statements: Dict[str, List[float]] = {}
+        self._started = time.perf_counter()
+
+    @property
+    def name(self) -> str:
+        return f"{self.method} {self.path}"
+
+    def record_sql(self, statement: str, elapsed_ms: float) -> None:
+        self.sql_count += 1
+        self.sql_ms += elapsed_ms
+        entry = self.statements.setdefault(statement, [0, 0.0])
+        entry[0] += 1
+        entry[1] += elapsed_ms
+
+    def repeated_statements(self, threshold: int = REPEAT_THRESHOLD) -> List[Tuple[str, int]]:
+        return sorted(
+            ((statement, int(count)) for statement, (count, _) in self.statements.items() if count >= threshold),
+            key=lambda item: -item[1],
+        )
+
+    def summary(self) -> dict:
+        slowest = sorted(self.statements.items(), key=lambda item: -item[1][1])[:5]
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration_ms, 2),
+            "samples": sum(self.stacks.values()),
+            "sql_count": self.sql_count,
+            "sql_ms": round(self.sql_ms, 2),
+            "slowest_statements": [
+                {"statement": statement, "count": int(count), "ms": round(ms, 2)}
+                for statement, (count, ms) in slowest
+            ],
+            "repeated_statements": [
+                {"statement": statement, "count": count} for statement, count in self.repeated_statements()
+            ],
+        }
+
+
+_current_profile: ContextVar[Optional[RequestProfile]] = ContextVar("request_profile", default=None)
+
+
+def profiled_endpoint_call(call):
+    """Wrap a sync endpoint so the thread running it is sampled while its request is profiled."""
+
+    @functools.wraps(call)
+    def profiled_endpoint(*args, **kwargs):
+        profile = _current_profile.get()
+        if profile is None:
+            return call(*args, **kwargs)
+        ident = threading.get_ident()
+        profile.threads.add(ident)
+        try:
+            return call(*args, **kwargs)
+        finally:
+            profile.threads.discard(ident)
+
+    return profiled_endpoint
+
+
+# Stacks are cut at the wrapper, so they start at the endpoint function.
+_ENDPOINT_CODE = profiled_endpoint_call(lambda: None).__code__
+
+
+def _stack(frame) -> Stack:
+    frames: List[Frame] = []
+    while frame is not None and frame.f_code is not _ENDPOINT_CODE and len(frames) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        frames.append((code.co_name, code.co_filename, code.co_firstlineno))
+        frame = frame.f_back
+    frames.reverse()
+    return tuple(frames)
+
+
+def instrument_routes(app) -> None:
+    """Wrap the app's sync endpoints; call once after all routes are declared."""
+    for route in app.routes:
+        if isinstance(route, APIRoute) and not asyncio.iscoroutinefunction(route.dependant.call):
+            if getattr(route.dependant.call, "__code__", None) is not _ENDPOINT_CODE:
+                route.dependant.call = profiled_endpoint_call(route.dependant.call)
+
+
+class Sampler:
+    """Samples the stacks of in-flight profiled requests on a daemon thread.
+
+    The thread is started by the first profiled request and exits when none is left.
+    """
+
+    def __init__(self, interval_ms: float = INTERVAL_MS):
+        self.interval = interval_ms / 1000.0
+        self._active: Dict[str, RequestProfile] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, profile: RequestProfile) -> None:
+        with self._lock:
+            self._active[profile.id] = profile
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="profile-sampler", daemon=True)
+                self._thread.start()
+
+    def remove(self, profile: RequestProfile) -> None:
+        with self._lock:
+            self._active.pop(profile.id, None)
+
+    def sample(self) -> None:
+        with self._lock:
+            profiles = list(self._active.values())
+        frames = sys._current_frames()
+        try:
+            for profile in profiles:
+                for ident in tuple(profile.threads):
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        profile.stacks[_stack(frame)] += 1
+        finally:
+            del frames
+
+    def _loop(self) -> None:
+        while True:
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    return
+            try:
+                self.sample()
+            except Exception:
+                logger.exception("Sampling request stacks failed")
+            time.sleep(self.interval)
+
+
+class Profiler:
+    """Per-worker profiling state: settings, the sampler and the kept profiles."""
+
+    def __init__(self, engine, interval_ms: float = INTERVAL_MS, keep: int = KEEP_PROFILES):
+        self.engine = engine
+        self.interval_ms = interval_ms
+        self.settings = Settings()
+        self.sampler = Sampler(interval_ms)
+        self._profiles: Deque[RequestProfile] = deque(maxlen=keep)
+        self._sql_hooks = False
+        self._lock = threading.Lock()
+        invalidation.subscribe("profiling", self._apply)
+
+    # Settings
+
+    def configure(self, settings: Settings) -> None:
+        """Apply settings in this worker only; see ``publish``."""
+        if settings.enabled:
+            self._install_sql_hooks()
+        self.settings = settings
+        logger.info(
+            "Request profiling %s (sample rate %s, paths %s)",
+            "enabled" if settings.active(time.time()) else "disabled",
+            settings.sample_rate,
+            list(settings.paths) or "all",
+        )
+
+    def publish(self, db: Session, settings: Settings) -> None:
+        """Store settings and apply them in every worker once ``db`` commits."""
+        crud.put_app_setting(db, SETTINGS_NAME, settings._asdict())
+        invalidation.publish(db, "profiling", json.dumps(settings._asdict()))
+
+    def load(self, db: Session) -> None:
+        """Apply the stored settings; run at worker startup, since change events only reach running workers."""
+        data = crud.get_app_setting(db, SETTINGS_NAME)
+        if data:
+            self.configure(Settings.from_dict(data))
+
+    def _apply(self, key: Optional[str]) -> None:
+        if key:
+            self.configure(Settings.from_dict(json.loads(key)))
+
+    def status(self) -> dict:
+        settings = self.settings
+        return {
+            **settings._asdict(),
+            "active": settings.active(time.time()),
+            "interval_ms": self.interval_ms,
+            "worker_pid": os.getpid(),
+            "profiles": len(self._profiles),
+        }
+
+    # Request path
+
+    def should_profile(self, path: str) -> bool:
+        settings = self.settings
+        if not settings.enabled or random.random() >= settings.sample_rate:
+            return False
+        if time.time() >= settings.until:
+            return False
+        if path.startswith(EXCLUDED_PREFIX):
+            return False
+        return not settings.paths or path.startswith(settings.paths)
+
+    def begin(self, method: str, path: str) -> RequestProfile:
+        profile = RequestProfile(method, path)
+        self.sampler.add(profile)
+        return profile
+
+    def finish(self, profile: RequestProfile) -> None:
+        self.sampler.remove(profile)
+        profile.duration_ms = (time.perf_counter() - profile._started) * 1000.0
+        with self._lock:
+            self._profiles.append(profile)
+        logger.info(
+            "Profiled %s: %s in %.1fms, %d samples, %d SQL statements in %.1fms",
+            profile.name, profile.status, profile.duration_ms,
+            sum(profile.stacks.values()), profile.sql_count, profile.sql_ms,
+        )
+        for statement, count in profile.repeated_statements():
+            logger.warning("Possible N+1 in %s: %d executions of %s", profile.name, count, " ".join(statement.split())[:300])
+
+    # SQL accounting
+
+    def _install_sql_hooks(self) -> None:
+        with self._lock:
+            if self._sql_hooks:
+                return
+            event.listen(self.engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(self.engine, "after_cursor_execute", _after_cursor_execute)
+            self._sql_hooks = True
+
+    # Results
+
+    def profiles(self, path: Optional[str] = None, profile_id: Optional[str] = None) -> List[RequestProfile]:
+        """Kept profiles, newest first, optionally filtered by path prefix or id."""
+        with self._lock:
+            profiles = list(self._profiles)
+        profiles.reverse()
+        if profile_id:
+            profiles = [profile for profile in profiles if profile.id == profile_id]
+        if path:
+            profiles = [profile for profile in profiles if profile.path.startswith(path)]
+        return profiles
+
+    def clear(self) -> int:
+        with self._lock:
+            count = len(self._profiles)
+            self._profiles.clear()
+        return count
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_profile.get() is not None:
+        conn.info.setdefault("profile_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current_profile.get()
+    starts = conn.info.get("profile_query_start")
+    if profile is not None and starts:
+        profile.record_sql(statement, (time.perf_counter() - starts.pop()) * 1000.0)
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that profiles the requests ``profiler`` samples."""
+
+    def __init__(self, app, profiler: Profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.should_profile(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        profile = self.profiler.begin(scope["method"], scope["path"])
+        token = _current_profile.set(profile)
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _current_profile.reset(token)
+            route = scope.get("route")
+            if route is not None and getattr(route, "path", None):
+                # Group /api/projects/{project_id} rather than every id separately.
+                profile.path = route.path
+            self.profiler.finish(profile)
+
+
+# Export formats
+
+def _frame_label(frame: Frame) -> str:
+    name, filename, line = frame
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def collapsed(profiles: Iterable[RequestProfile]) -> str:
+    """Brendan Gregg's collapsed format: ``root;caller;callee count`` per line, rooted at the request."""
+    totals: Counter = Counter()
+    for profile in profiles:
+        for stack, count in profile.stacks.items():
+            totals[";".join([profile.name] + [_frame_label(frame) for frame in stack])] += count
+    return "".join(f"{line} {count}\n" for line, count in sorted(totals.items()))
+
+
+def speedscope(profiles: Iterable[RequestProfile], interval_ms: float = INTERVAL_MS) -> dict:
+    """A speedscope file with one sampled profile per request, weighted in milliseconds."""
+    frames: List[dict] = []
+    index: Dict[Frame, int] = {}
+    documents = []
+    for profile in profiles:
+        samples = []
+        weights = []
+        for stack, count in profile.stacks.items():
+            indices = []
+            for frame in stack:
+                if frame not in index:
+                    index[frame] = len(frames)
+                    frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+                indices.append(index[frame])
+            samples.append(indices)
+            weights.append(count * interval_ms)
+        documents.append({
+            "type": "sampled",
+            "name": f"{profile.name} {profile.id[:8]} ({profile.duration_ms:.1f}ms, {profile.sql_count} SQL)",
+            "unit": "milliseconds",
+            "startValue": 0,
+            "endValue": sum(weights),
+            "samples": samples,
+            "weights": weights,
+        })
+    return {
+        "$schema": SPEEDSCOPE_SCHEMA,
+        "name": "LeakGuard request profiles",
+        "exporter": "leakguard",
+        "shared": {"frames": frames},
+        "profiles": documents,
+    }
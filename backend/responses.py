@@ -0,0 +1,16 @@
+"""Fast JSON response class for list endpoints."""
+import orjson
+from fastapi.responses import JSONResponse
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered with orjson.
+
+    Produces the same bytes as FastAPI's default encoding of the equivalent
+    response model for the plain values the list endpoints return (str, int,
+    bool, None, list, dict and datetime). ``OPT_UTC_Z`` matches Pydantic's
+    ``Z`` suffix for UTC datetimes.
+    """
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_UTC_Z)
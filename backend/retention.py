@@ -0,0 +1,134 @@
+"""Log retention: per-project purge policy and the background scheduler enforcing it.
+
+Each project may set ``retention_days``; logs of projects without one use
+``LOG_RETENTION_DAYS`` (unset keeps them forever). Expired rows are deleted
+through the (project, timestamp) index in small batches, each in its own short
+transaction, so a purge never holds the SQLite write lock for long. Freed
+pages are handed back with ``PRAGMA incremental_vacuum`` instead of a full
+``VACUUM``.
+
+Every worker runs a ``RetentionScheduler``, but a scheduled purge only runs
+in the worker holding the ``retention`` lease (``job_leases``), taken for one
+interval at a time, so workers never purge concurrently and compete for the
+SQLite write lock. If the holder dies, another worker takes over once its
+lease expires.
+"""
+import logging
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+import crud
+import models
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "5000"))
+INTERVAL_SECONDS = int(os.getenv("RETENTION_INTERVAL_SECONDS", "3600"))
+LEASE_NAME = "retention"
+
+
+def default_retention_days() -> Optional[int]:
+    value = os.getenv("LOG_RETENTION_DAYS")
+    return int(value) if value else None
+
+
+def _delete_batch(db: Session, cutoff: datetime, project: Optional[str], exclude: List[str]) -> int:
+    """Delete up to BATCH_SIZE expired logs and their log_threats rows; returns the count."""
+    query = db.query(models.LogEntry.id).filter(models.LogEntry.timestamp < cutoff)
+    if project is not None:
+        query = query.filter(models.LogEntry.project == project)
+    elif exclude:
+        query = query.filter(models.LogEntry.project.notin_(exclude))
+    ids = [log_id for (log_id,) in query.limit(BATCH_SIZE).all()]
+    if not ids:
+        return 0
+    crud.delete_log_entries(db, ids)
+    db.commit()
+    return len(ids)
+
+
+def _purge(db: Session, cutoff: datetime, project: Optional[str] = None, exclude: Optional[List[str]] = None) -> int:
+    deleted = 0
+    while True:
+        count = _delete_batch(db, cutoff, project, exclude or [])
+        deleted += count
+        if count < BATCH_SIZE:
+            return deleted
+
+
+def enforce_retention(db: Session, now: Optional[datetime] = None) -> Dict[str, int]:
+    """Purge expired logs for every project; returns deleted row counts per project name."""
+    now = (now or datetime.now(timezone.utc)).astimezone(timezone.utc).replace(tzinfo=None)
+    deleted: Dict[str, int] = {}
+
+    configured = (
+        db.query(models.Project.name, models.Project.retention_days)
+        .filter(models.Project.retention_days.isnot(None))
+        .all()
+    )
+    for name, days in configured:
+        deleted[name] = _purge(db, now - timedelta(days=days), project=name)
+
+    default_days = default_retention_days()
+    if default_days is not None:
+        deleted["*"] = _purge(db, now - timedelta(days=default_days), exclude=[name for name, _ in configured])
+
+    crud.prune_activity(db)
+    if db.get_bind().dialect.name == "sqlite" and any(deleted.values()):
+        # The pragma frees one page per step and pysqlite's execute() steps a
+        # row-less statement only once; executescript() runs it to completion.
+        db.commit()
+        db.connection().connection.driver_connection.executescript("PRAGMA incremental_vacuum;")
+        db.commit()
+    return deleted
+
+
+class RetentionScheduler:
+    """Runs ``enforce_retention`` every ``interval`` seconds on a daemon thread."""
+
+    def __init__(self, session_factory, interval: int = INTERVAL_SECONDS):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def acquire(self) -> bool:
+        """Whether this worker runs the next scheduled purge (holds the lease for one interval)."""
+        db = self.session_factory()
+        try:
+            return crud.acquire_lease(db, LEASE_NAME, self.holder, self.interval)
+        finally:
+            db.close()
+
+    def run_once(self) -> Dict[str, int]:
+        db = self.session_factory()
+        try:
+            return enforce_retention(db)
+        finally:
+            db.close()
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                if not self.acquire():
+                    continue
+                deleted = self.run_once()
+                if any(deleted.values()):
+                    logger.info("Retention purge deleted %s", deleted)
+            except Exception:
+                logger.exception("Retention purge failed")
+
+    def start(self) -> None:
+        if self._thread is None and self.interval > 0:
+            self._thread = threading.Thread(target=self._loop, name="log-retention", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
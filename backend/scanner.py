@@ -0,0 +1,185 @@
+"""Chunked threat scanning over arbitrarily large guard inputs.
+
+All messages of a request are scanned as one newline-joined stream, cut into
+windows of ``GUARD_CHUNK_CHARS`` characters. Each window repeats the last
+``GUARD_CHUNK_OVERLAP`` characters of the previous one, so any match shorter
+than the overlap is seen whole even when it crosses a window or message
+boundary. Window edges inside the stream are artificial, so matches touching
+them are left to the neighbouring window, where that text has real context. The stream is never concatenated, so memory stays at about one
+window per request.
+
+Work per request is bounded: scanning stops after ``GUARD_MAX_CHARS``
+characters (the rest is reported as truncated), when ``GUARD_TIME_BUDGET_MS``
+is spent, or, with ``stop_on_block``, at the first hit of a blocking rule. A
+truncated or timed-out scan is never reported as clean: it adds the
+``ScanIncomplete`` threat.
+``joined_text`` gives the same stream, cut at ``GUARD_MAX_CHARS``, for storing
+what was scanned. Request bodies are capped at ``GUARD_MAX_BODY_BYTES`` before
+they are parsed (``limits.BodySizeLimitMiddleware``).
+"""
+import os
+import re
+import time
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Pattern, Sequence, Tuple
+
+CHUNK_CHARS = int(os.getenv("GUARD_CHUNK_CHARS", "65536"))
+OVERLAP_CHARS = int(os.getenv("GUARD_CHUNK_OVERLAP", "256"))
+MAX_CHARS = int(os.getenv("GUARD_MAX_CHARS", str(4 * 1024 * 1024)))
+TIME_BUDGET_MS = float(os.getenv("GUARD_TIME_BUDGET_MS", "50"))
+MAX_BODY_BYTES = int(os.getenv("GUARD_MAX_BODY_BYTES", str(8 * 1024 * 1024)))
+
+# Threat reported when part of the input was not scanned.
+INCOMPLETE_THREAT = "ScanIncomplete"
+
+
+class Rule(NamedTuple):
+    threat: str  # name recorded in log_entries.threats_detected
+    category: str  # playground result type (crud.THREAT_TYPES)
+    pattern: Pattern
+    confidence: int
+    blocking: bool
+
+
+# Patterns must match fewer than OVERLAP_CHARS characters, so quantifiers stay bounded.
+RULES: List[Rule] = [
+    Rule("PII", "Data Leakage", re.compile(r"374245455400128"), 95, True),
+    Rule("SecretsLeak", "Data Leakage", re.compile(r"\bAKIA[0-9A-Z]{16}\b"), 95, True),
+    Rule("PromptInjection", "Prompt Attack", re.compile(r"developer\s{1,8}instructions", re.I), 90, True),
+    Rule("Jailbreak", "Prompt Attack", re.compile(r"\byou\s{1,8}are\s{1,8}DAN\b", re.I), 90, True),
+    Rule("Toxicity", "Content Violation", re.compile(r"mushrooms", re.I), 85, False),
+]
+
+
+class ScanResult(NamedTuple):
+    threats: List[str]
+    confidence: Dict[str, int]  # by rule category, highest matched confidence
+    scanned_chars: int
+    total_chars: int
+    truncated: bool  # stopped at max_chars
+    timed_out: bool  # stopped at the time budget
+    stopped_early: bool  # stopped at a blocking hit
+    elapsed_ms: float
+
+
+def iter_windows(
+    texts: Sequence[str], chunk_chars: int, overlap: int, max_chars: int
+) -> Iterator[Tuple[str, int]]:
+    """Yield ``(window, carried)`` over ``texts`` joined by newlines, covering at most ``max_chars``.
+
+    ``carried`` is how many leading characters repeat the previous window.
+    """
+    pieces: List[str] = []
+    size = 0
+    tail = ""
+    remaining = max_chars
+    for index, text in enumerate(texts):
+        if index:
+            pieces.append("\n")
+            size += 1
+            remaining -= 1
+        position = 0
+        while position < len(text) and remaining > 0:
+            take = min(chunk_chars - size, len(text) - position, remaining)
+            pieces.append(text[position:position + take])
+            size += take
+            position += take
+            remaining -= take
+            if size >= chunk_chars:
+                window = tail + "".join(pieces)
+                yield window, len(tail)
+                tail = window[-overlap:] if overlap else ""
+                pieces, size = [], 0
+        if remaining <= 0:
+            break
+    if size:
+        yield tail + "".join(pieces), len(tail)
+
+
+def _search(pattern: Pattern, window: str, start: int, final: bool):
+    """First match of ``pattern`` in ``window`` from ``start``.
+
+    Unless the window ends the stream, a match reaching its last character may
+    only exist because the text is cut there (``\\b``, ``$``); it is skipped and
+    left to the next window, which repeats that text.
+    """
+    match = pattern.search(window, start)
+    while match and not final and match.end() == len(window):
+        match = pattern.search(window, match.start() + 1)
+    return match
+
+
+def joined_text(texts: Iterable[str], max_chars: int = MAX_CHARS) -> str:
+    """The non-empty ``texts`` joined by newlines, as scanned, cut at ``max_chars``."""
+    pieces: List[str] = []
+    remaining = max_chars
+    for text in texts:
+        if not text:
+            continue
+        if pieces:
+            pieces.append("\n")
+            remaining -= 1
+        if remaining <= 0:
+            break
+        pieces.append(text[:remaining])
+        remaining -= len(pieces[-1])
+    return "".join(pieces)[:max_chars]
+
+
+def scan(
+    texts: Iterable[str],
+    rules: Sequence[Rule] = RULES,
+    stop_on_block: bool = True,
+    chunk_chars: int = CHUNK_CHARS,
+    overlap: int = OVERLAP_CHARS,
+    max_chars: int = MAX_CHARS,
+    time_budget_ms: float = TIME_BUDGET_MS,
+) -> ScanResult:
+    """Run ``rules`` over the newline-joined ``texts`` within the size and time limits."""
+    started = time.perf_counter()
+    texts = [text for text in texts if text]
+    total = sum(len(text) for text in texts) + max(0, len(texts) - 1)
+    deadline = started + time_budget_ms / 1000.0
+    pending = list(rules)
+    found: List[Rule] = []
+    scanned = 0
+    timed_out = stopped_early = False
+
+    limit = min(total, max_chars)
+    for window, carried in iter_windows(texts, chunk_chars, max(0, overlap), max_chars):
+        # A window whose carried part was cut from the middle of the stream
+        # starts at an artificial boundary; searching from its second character
+        # keeps \b from matching there. Anything starting at that first
+        # character was already seen whole in the previous window.
+        start = 1 if carried and scanned > carried else 0
+        scanned += len(window) - carried
+        final = scanned >= total
+        for rule in list(pending):
+            if _search(rule.pattern, window, start, final):
+                found.append(rule)
+                pending.remove(rule)
+        if stop_on_block and any(rule.blocking for rule in found):
+            stopped_early = scanned < limit
+            break
+        if not pending:
+            break
+        if time.perf_counter() > deadline and scanned < limit:
+            timed_out = True
+            break
+
+    confidence: Dict[str, int] = {}
+    for rule in found:
+        confidence[rule.category] = max(confidence.get(rule.category, 0), rule.confidence)
+    threats = [rule.threat for rule in rules if rule in found]
+    truncated = total > max_chars and scanned >= max_chars
+    if truncated or timed_out:
+        threats.append(INCOMPLETE_THREAT)
+    return ScanResult(
+        threats=threats,
+        confidence=confidence,
+        scanned_chars=scanned,
+        total_chars=total,
+        truncated=truncated,
+        timed_out=timed_out,
+        stopped_early=stopped_early,
+        elapsed_ms=(time.perf_counter() - started) * 1000.0,
+    )
@@ -1,6 +1,16 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, field_validator
 from datetime import datetime
-from typing import Optional, List
+from typing import Literal, Optional, List
+from urllib.parse import urlparse
+
+class ActivityWindow(BaseModel):
+    requests: int = 0
+    threats: int = 0
+
+class ActivityStats(BaseModel):
+    last_1h: ActivityWindow = ActivityWindow()
+    last_24h: ActivityWindow = ActivityWindow()
+    last_7d: ActivityWindow = ActivityWindow()
 
 class ProjectBase(BaseModel):
     name: str
@@ -10,6 +20,11 @@ class ProjectBase(BaseModel):
     is_public: Optional[bool] = False
     proxy_slug: Optional[str] = None
     supported_llms: Optional[List[str]] = None
+    retention_days: Optional[int] = None
+    # Which /v2/guard decisions get a log_entries row; flagged requests are always kept.
+    log_mode: Literal["full", "threats_only", "sampled", "counts_only"] = "full"
+    log_sample_rate: Optional[float] = Field(default=None, ge=0, le=1)
+    daily_token_quota: Optional[int] = Field(default=None, ge=0)
 
 class ProjectCreate(ProjectBase):
     pass
@@ -17,6 +32,7 @@ class ProjectCreate(ProjectBase):
 class Project(ProjectBase):
     id: str
     created_at: datetime
+    activity: Optional[ActivityStats] = None
 
     class Config:
         from_attributes = True
@@ -40,6 +56,7 @@ class PolicyCreate(PolicyBase):
 class Policy(PolicyBase):
     id: str
     last_edited: datetime
+    activity: Optional[ActivityStats] = None
 
     class Config:
         from_attributes = True
@@ -78,6 +95,8 @@ class LogEntryCreate(LogEntryBase):
 class LogEntry(LogEntryBase):
     id: str
     timestamp: datetime
+    # Set by the server from the config snapshot; clients cannot supply it.
+    policy_version: Optional[int] = None
 
     class Config:
         from_attributes = True
@@ -103,6 +122,9 @@ class GuardV2Message(BaseModel):
 
 class GuardV2Request(BaseModel):
     messages: List[GuardV2Message]
+    # For clean requests only (flagged ones are always written synchronously):
+    # sync: write before responding; async: queue for the background writer; none: counts only
+    persist: Literal["sync", "async", "none"] = "sync"
 
 
 class AnalyticsPoint(BaseModel):
@@ -118,6 +140,11 @@ class AnalyticsResponse(BaseModel):
     timeseries: List[AnalyticsPoint]
 
 
+class ThreatCount(BaseModel):
+    threat: str
+    count: int
+
+
 class LLMChatMessage(BaseModel):
     role: str  # "user" or "assistant"
     content: str
@@ -134,3 +161,47 @@ class LLMChatResponse(BaseModel):
     choices: List[dict]
     usage: dict
 
+
+class TokenUsage(BaseModel):
+    hour: datetime
+    model: str
+    requests: int
+    prompt_tokens: int
+    completion_tokens: int
+
+
+class WebhookBase(BaseModel):
+    target_url: str  # http(s):// endpoint or file:// path of an append-only event log
+    include_content: bool = False
+    is_active: bool = True
+
+    @field_validator("target_url")
+    @classmethod
+    def check_target_url(cls, value: str) -> str:
+        parsed = urlparse(value)
+        if parsed.scheme == "file":
+            if not parsed.path:
+                raise ValueError("file:// target needs a path")
+        elif parsed.scheme not in ("http", "https") or not parsed.netloc:
+            raise ValueError("target_url must be an http(s):// URL or a file:// path")
+        return value
+
+class WebhookCreate(WebhookBase):
+    secret: Optional[str] = None
+
+class Webhook(WebhookBase):
+    id: str
+    project_id: str
+    created_at: datetime
+    pending_events: int = 0
+    dead_events: int = 0
+
+    class Config:
+        from_attributes = True
+
+
+class ProfilingSettings(BaseModel):
+    enabled: bool
+    sample_rate: float = Field(0.01, ge=0, le=1)
+    paths: List[str] = []  # path prefixes to profile, e.g. ["/v2/guard"]; empty profiles every path
+    duration_seconds: int = Field(900, ge=1, le=86400)
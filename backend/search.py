@@ -0,0 +1,148 @@
+"""Full-text search over logged prompts.
+
+SQLite uses an external-content FTS5 table (``log_entries_fts``) that indexes
+``log_entries.content`` by rowid and is kept in sync by triggers, so bulk
+inserts are indexed as well. PostgreSQL uses a GIN index over
+``to_tsvector('simple', content)``. Other backends fall back to ``LIKE``.
+
+A full ``VACUUM`` may renumber SQLite rowids; run ``python search.py rebuild``
+afterwards.
+"""
+import re
+import sys
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import Column, DateTime, bindparam, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+FTS_TABLE = "log_entries_fts"
+PG_INDEX = "ix_log_entries_content_fts"
+
+SQLITE_SCHEMA = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "content, content='log_entries', content_rowid='rowid', tokenize='unicode61')",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON log_entries BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.rowid, new.content); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON log_entries BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.rowid, old.content); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF content ON log_entries BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.rowid, old.content); "
+    f"INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.rowid, new.content); END",
+]
+
+
+def ensure_search_index(engine: Engine) -> None:
+    """Create the search index if missing; a fresh SQLite index is built from existing rows."""
+    with engine.begin() as connection:
+        if engine.dialect.name == "sqlite":
+            installed = connection.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = :name"),
+                {"name": f"{FTS_TABLE}_ai"},
+            ).first()
+            if installed:
+                return
+            for statement in SQLITE_SCHEMA:
+                connection.exec_driver_sql(statement)
+            connection.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        elif engine.dialect.name == "postgresql":
+            connection.exec_driver_sql(
+                f"CREATE INDEX IF NOT EXISTS {PG_INDEX} ON log_entries "
+                "USING GIN (to_tsvector('simple', content))"
+            )
+
+
+def rebuild_search_index(engine: Engine) -> None:
+    """Re-index every log entry (SQLite only; PostgreSQL indexes stay consistent)."""
+    ensure_search_index(engine)
+    if engine.dialect.name == "sqlite":
+        with engine.begin() as connection:
+            connection.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def to_fts5_query(q: str) -> str:
+    """Turn user input into a safe FTS5 query.
+
+    Double-quoted segments are kept as phrases and every other word becomes a
+    quoted token, so FTS5 operators and punctuation in the input are literal.
+    All terms must match.
+    """
+    terms: List[str] = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', q):
+        term = (phrase or word).strip()
+        if term:
+            terms.append('"%s"' % term.replace('"', '""'))
+    return " ".join(terms)
+
+
+def search_log_entries(
+    db: Session,
+    columns: List[Column],
+    q: str,
+    skip: int = 0,
+    limit: int = 100,
+    project: Optional[str] = None,
+    threat: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> List[dict]:
+    """Return log rows matching ``q``, best match first, as dicts keyed by column name.
+
+    ``columns`` are ``log_entries`` table columns; their types decode the raw
+    values (JSON, datetimes) just like an ORM query would. ``since``/``until``
+    are naive UTC datetimes, as stored.
+    """
+    dialect = db.get_bind().dialect.name
+    selected = ", ".join(f"log_entries.{column.name}" for column in columns)
+    params = {"skip": skip, "limit": limit, "project": project, "threat": threat}
+    filters = ""
+    if project:
+        filters += " AND log_entries.project = :project"
+    if threat:
+        filters += " AND log_entries.id IN (SELECT log_id FROM log_threats WHERE threat = :threat)"
+    # Bound as DateTime so values are rendered in the same format as stored timestamps.
+    bounds = []
+    if since:
+        filters += " AND log_entries.timestamp >= :since"
+        params["since"] = since
+        bounds.append(bindparam("since", type_=DateTime()))
+    if until:
+        filters += " AND log_entries.timestamp < :until"
+        params["until"] = until
+        bounds.append(bindparam("until", type_=DateTime()))
+    if dialect == "sqlite":
+        params["q"] = to_fts5_query(q)
+        if not params["q"]:
+            return []
+        sql = (
+            f"SELECT {selected} FROM {FTS_TABLE} "
+            f"JOIN log_entries ON log_entries.rowid = {FTS_TABLE}.rowid "
+            f"WHERE {FTS_TABLE} MATCH :q{filters} ORDER BY {FTS_TABLE}.rank LIMIT :limit OFFSET :skip"
+        )
+    elif dialect == "postgresql":
+        params["q"] = q
+        sql = (
+            f"SELECT {selected} FROM log_entries, websearch_to_tsquery('simple', :q) AS query "
+            f"WHERE to_tsvector('simple', content) @@ query{filters} "
+            "ORDER BY ts_rank(to_tsvector('simple', content), query) DESC, log_entries.timestamp DESC "
+            "LIMIT :limit OFFSET :skip"
+        )
+    else:
+        params["q"] = "%" + q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        sql = (
+            f"SELECT {selected} FROM log_entries WHERE content LIKE :q ESCAPE '\\'{filters} "
+            "ORDER BY log_entries.timestamp DESC LIMIT :limit OFFSET :skip"
+        )
+    result = db.execute(text(sql).bindparams(*bounds).columns(*columns), params)
+    return [dict(row._mapping) for row in result]
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    if sys.argv[1:] == ["rebuild"]:
+        rebuild_search_index(engine)
+        print("✓ Rebuilt log search index")
+    else:
+        print("Usage: python search.py rebuild")
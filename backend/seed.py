@@ -41,47 +41,42 @@ def seed(db: Session):
         },
     ]
 
-    created_policies = []
-    for p in policies:
-        pc = schemas.PolicyCreate(**p)
-        created_policies.append(crud.create_policy(db, pc))
+    created_policies = crud.bulk_create_policies(db, [schemas.PolicyCreate(**p) for p in policies])
 
     # Projects
     projects = [
         {
             "name": "First Project",
             "project_id": "project-3043777887",
-            "policy": created_policies[0].name,
+            "policy": policies[0]["name"],
             "project_metadata": "-",
         }
     ]
 
-    created_projects = []
-    for pr in projects:
-        proj = schemas.ProjectCreate(**pr)
-        created_projects.append(crud.create_project(db, proj))
+    created_projects = crud.bulk_create_projects(db, [schemas.ProjectCreate(**pr) for pr in projects])
 
     # API Keys (link to first project)
-    api_key_payload = schemas.ApiKeyCreate(name="First Project Key", project_id=created_projects[0].id)
+    api_key_payload = schemas.ApiKeyCreate(name="First Project Key", project_id=created_projects[0])
     created_key = crud.create_api_key(db, api_key_payload)
 
     # Sample log entry
     log = schemas.LogEntryCreate(
-        project=created_projects[0].name,
+        project=projects[0]["name"],
         threats_detected=["prompt-injection"],
         content="User input containing potential prompt injection",
-        policy=created_policies[0].name,
+        policy=policies[0]["name"],
         request_id="req-12345",
         latency=123,
         region="us-east-1",
         log_entry_metadata="{}",
     )
-    crud.create_log_entry(db, log)
+    crud.bulk_create_log_entries(db, [log])
 
     print("Seeded DB with:")
     print(f"  policies: {len(created_policies)}")
     print(f"  projects: {len(created_projects)}")
     print(f"  api_key: {created_key.key} (store this safely)")
+    return created_key
 
 
 if __name__ == "__main__":
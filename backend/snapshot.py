@@ -0,0 +1,111 @@
+"""Versioned, immutable in-memory snapshot of all projects and policies.
+
+Request paths (``/v2/guard``, the proxy) resolve configuration from
+``current(db)`` instead of querying. A snapshot is never modified: when a
+project or policy changes, ``invalidation`` marks it stale and the next caller
+loads a new one and swaps the module reference, so readers always see one
+consistent version without locks.
+
+The version is the newest ``config_changes`` id at load time. Every config
+write appends to that table, so versions only grow, are the same in every
+worker, and are stamped on log entries as ``policy_version`` to record which
+configuration produced a decision.
+"""
+import threading
+from types import MappingProxyType
+from typing import Mapping, NamedTuple, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+import invalidation
+import models
+
+
+class ProjectConfig(NamedTuple):
+    id: str
+    name: str
+    project_id: str
+    policy: str
+    is_public: bool
+    proxy_slug: Optional[str]
+    supported_llms: Tuple[str, ...]
+    log_mode: str
+    log_sample_rate: Optional[float]
+    daily_token_quota: Optional[int]
+
+
+class PolicyConfig(NamedTuple):
+    id: str
+    name: str
+    policy_id: str
+    guardrails: Tuple[str, ...]
+    sensitivity: str
+
+
+class ConfigSnapshot(NamedTuple):
+    version: int
+    projects: Mapping[str, ProjectConfig]  # by id
+    projects_by_slug: Mapping[str, ProjectConfig]
+    policies: Mapping[str, PolicyConfig]  # by name, as referenced by Project.policy
+
+    def policy_for(self, project: Optional[ProjectConfig]) -> Optional[PolicyConfig]:
+        return self.policies.get(project.policy) if project else None
+
+
+_current: Optional[ConfigSnapshot] = None
+_stale = True
+_generation = 0  # bumped by every invalidation
+_lock = threading.Lock()
+
+
+def _mark_stale(key: Optional[str] = None) -> None:
+    global _stale, _generation
+    _generation += 1
+    _stale = True
+
+
+invalidation.subscribe("projects", _mark_stale)
+invalidation.subscribe("policies", _mark_stale)
+
+
+def load(db: Session) -> ConfigSnapshot:
+    """Read a new snapshot from the database."""
+    version = db.query(func.max(models.ConfigChange.id)).scalar() or 0
+    projects = {}
+    slugs = {}
+    project_columns = [getattr(models.Project, name) for name in ProjectConfig._fields]
+    for row in db.query(*project_columns).all():
+        config = ProjectConfig(*row)._replace(
+            is_public=bool(row.is_public),
+            supported_llms=tuple(row.supported_llms or ()),
+            log_mode=row.log_mode or "full",
+        )
+        projects[config.id] = config
+        if config.proxy_slug:
+            slugs[config.proxy_slug] = config
+    policy_columns = [getattr(models.Policy, name) for name in PolicyConfig._fields]
+    policies = {
+        row.name: PolicyConfig(*row)._replace(guardrails=tuple(row.guardrails or ()))
+        for row in db.query(*policy_columns).all()
+    }
+    return ConfigSnapshot(version, MappingProxyType(projects), MappingProxyType(slugs), MappingProxyType(policies))
+
+
+def current(db: Session) -> ConfigSnapshot:
+    """The latest snapshot; reloads (once per change per worker) when a write made it stale."""
+    global _current, _stale
+    snapshot = _current
+    if snapshot is not None and not _stale:
+        return snapshot
+    with _lock:
+        if _current is None or _stale:
+            generation = _generation
+            fresh = load(db)  # if this raises, the snapshot stays stale and the next caller retries
+            # A concurrent reload may have seen a newer version; never go back.
+            if _current is None or fresh.version >= _current.version:
+                _current = fresh
+            # An invalidation that arrived during the load needs another reload.
+            if generation == _generation:
+                _stale = False
+        return _current
@@ -0,0 +1,27 @@
+import os
+import sys
+import tempfile
+
+# The backend modules are flat and import each other by name.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Set before the app modules create the engine or read their settings.
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db"))
+os.environ.setdefault("DISABLE_AUTH", "true")
+os.environ.setdefault("API_KEY_PEPPER", "test-pepper")
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    import models
+    from database import SessionLocal, engine
+
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
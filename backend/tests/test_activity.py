@@ -0,0 +1,36 @@
+from datetime import datetime, timedelta, timezone
+
+import crud
+import models
+
+
+def log_row(project, threats, timestamp, policy="default"):
+    return {"project": project, "policy": policy, "threats_detected": threats, "timestamp": timestamp}
+
+
+def test_record_activity_upserts_into_buckets(db):
+    now = datetime.now(timezone.utc)
+    crud.record_activity(db, [log_row("p", [], now), log_row("p", ["PII"], now)])
+    db.commit()
+    crud.record_activity(db, [log_row("p", ["PII"], now)])
+    db.commit()
+
+    bucket = int(now.timestamp()) // crud.ACTIVITY_BUCKET_SECONDS * crud.ACTIVITY_BUCKET_SECONDS
+    rows = {(r.scope, r.name, r.bucket): (r.requests, r.threats) for r in db.query(models.ActivityRollup)}
+    assert rows == {("project", "p", bucket): (3, 2), ("policy", "default", bucket): (3, 2)}
+
+
+def test_activity_windows(db):
+    now = datetime.now(timezone.utc)
+    crud.record_activity(db, [
+        log_row("p", ["PII"], now),
+        log_row("p", [], now - timedelta(hours=5)),
+        log_row("p", [], now - timedelta(days=3)),
+        log_row("p", [], now - timedelta(days=30)),
+    ])
+    db.commit()
+    stats = crud.get_activity(db, "project", ["p", "missing"])["p"]
+    assert (stats.last_1h.requests, stats.last_1h.threats) == (1, 1)
+    assert stats.last_24h.requests == 2
+    assert stats.last_7d.requests == 3
+    assert "missing" not in crud.get_activity(db, "project", ["missing"])
@@ -0,0 +1,60 @@
+import pytest
+
+import crud
+import schemas
+
+
+@pytest.fixture(autouse=True)
+def fresh_key_index():
+    crud._invalidate_api_key_index()
+    yield
+    crud.api_key_pepper.cache_clear()
+    crud._invalidate_api_key_index()
+
+
+def test_stored_columns_never_contain_the_key():
+    key = "lk_AbCdEfGh" + "x" * 30 + "wxyz"
+    columns = crud.api_key_columns(key)
+    assert columns["key_prefix"] == key[:crud.API_KEY_PREFIX_LENGTH]
+    assert columns["key"] == "lk_AbCdEfGh…wxyz"
+    assert key not in columns.values()
+    assert columns["key_hash"] == crud.hash_api_key(key)
+
+
+def test_created_key_resolves_and_wrong_keys_do_not(db):
+    created = crud.create_api_key(db, schemas.ApiKeyCreate(name="k", project_id="p1"))
+    plaintext = created.key
+    assert plaintext.startswith("lk_")
+
+    info = crud.resolve_api_key(db, plaintext)
+    assert info == crud.ApiKeyInfo(created.id, "p1")
+    assert crud.resolve_api_key(db, plaintext[:-1] + ("A" if plaintext[-1] != "A" else "B")) is None
+    assert crud.resolve_api_key(db, "lk_unknown0" + "x" * 32) is None
+
+
+def test_key_does_not_verify_under_another_pepper(db, monkeypatch):
+    plaintext = crud.create_api_key(db, schemas.ApiKeyCreate(name="k")).key
+    monkeypatch.setenv("API_KEY_PEPPER", "another-pepper")
+    crud.api_key_pepper.cache_clear()
+    crud._invalidate_api_key_index()
+    assert crud.resolve_api_key(db, plaintext) is None
+
+
+def test_missing_pepper_fails_unless_dev_is_allowed(monkeypatch):
+    monkeypatch.delenv("API_KEY_PEPPER", raising=False)
+    monkeypatch.setenv("DISABLE_AUTH", "false")
+    monkeypatch.delenv("API_KEY_ALLOW_DEV_PEPPER", raising=False)
+    crud.api_key_pepper.cache_clear()
+    with pytest.raises(RuntimeError):
+        crud.api_key_pepper()
+    monkeypatch.setenv("API_KEY_ALLOW_DEV_PEPPER", "true")
+    crud.api_key_pepper.cache_clear()
+    assert crud.api_key_pepper() == crud._DEV_PEPPER.encode()
+
+
+def test_unknown_prefix_is_cached_until_a_key_changes(db):
+    unknown = "lk_Missing1" + "x" * 32
+    assert crud.resolve_api_key(db, unknown) is None
+    assert "lk_Missing1" in crud._api_key_misses
+    crud.create_api_key(db, schemas.ApiKeyCreate(name="k"))
+    assert crud._api_key_misses == {}
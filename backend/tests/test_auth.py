@@ -0,0 +1,45 @@
+import requests
+
+import auth
+
+
+class FakeResponse:
+    def __init__(self, keys):
+        self.keys = keys
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"keys": self.keys}
+
+
+def test_jwks_is_cached_and_refreshed_for_unknown_keys(monkeypatch):
+    fetches = []
+
+    def fake_get(url, timeout):
+        fetches.append(url)
+        return FakeResponse([{"kid": str(len(fetches))}])
+
+    monkeypatch.setattr(requests, "get", fake_get)
+    monkeypatch.setattr(auth, "_jwks", None)
+    monkeypatch.setattr(auth, "JWKS_MIN_REFRESH_SECONDS", 0)
+
+    assert auth.get_jwks() == {"keys": [{"kid": "1"}]}
+    assert auth.get_jwks() == {"keys": [{"kid": "1"}]}
+    assert len(fetches) == 1
+    assert auth.get_jwks(refresh=True) == {"keys": [{"kid": "2"}]}
+
+
+def test_jwks_refresh_is_rate_limited(monkeypatch):
+    fetches = []
+
+    def fake_get(url, timeout):
+        fetches.append(url)
+        return FakeResponse([])
+
+    monkeypatch.setattr(requests, "get", fake_get)
+    monkeypatch.setattr(auth, "_jwks", None)
+    auth.get_jwks()
+    auth.get_jwks(refresh=True)
+    assert len(fetches) == 1
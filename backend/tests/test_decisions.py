@@ -0,0 +1,90 @@
+import crud
+import decisions
+import models
+import schemas
+from database import SessionLocal
+from decisions import BackgroundLogWriter, RecentDecisions, RingBuffer
+
+
+def test_ring_buffer_keeps_newest_after_wraparound():
+    buffer = RingBuffer(3)
+    for i in range(5):
+        buffer.append({"i": i})
+    assert len(buffer) == 3
+    assert [item["i"] for item in buffer.latest()] == [4, 3, 2]
+    assert [item["i"] for item in buffer.latest(2)] == [4, 3]
+
+
+def test_ring_buffer_before_full():
+    buffer = RingBuffer(4)
+    buffer.append({"i": 0})
+    buffer.append({"i": 1})
+    assert [item["i"] for item in buffer.latest(10)] == [1, 0]
+
+
+def test_recent_decisions_are_per_project():
+    recent = RecentDecisions(capacity=2)
+    recent.record("a", {"i": 1})
+    recent.record("b", {"i": 2})
+    assert recent.latest("a") == [{"i": 1}]
+    assert recent.latest("missing") == []
+
+
+def test_writer_retries_failed_batches(monkeypatch):
+    monkeypatch.setattr(decisions, "WRITE_ATTEMPTS", 3)
+    writer = BackgroundLogWriter(session_factory=None, interval=0.001)
+    calls = []
+
+    def flaky_write(batch):
+        calls.append(len(batch))
+        if len(calls) < 3:
+            raise RuntimeError("database is locked")
+
+    writer.write = flaky_write
+    assert writer.write_with_retry(["decision"])
+    assert calls == [1, 1, 1]
+    assert writer.dropped == 0
+
+
+def test_writer_drops_batch_after_last_attempt(monkeypatch):
+    monkeypatch.setattr(decisions, "WRITE_ATTEMPTS", 2)
+    writer = BackgroundLogWriter(session_factory=None, interval=0.001)
+
+    def failing_write(batch):
+        raise RuntimeError("database is locked")
+
+    writer.write = failing_write
+    assert not writer.write_with_retry(["a", "b"])
+    assert writer.dropped == 2
+
+
+def test_failed_last_used_update_is_retried_without_double_counting(db, monkeypatch):
+    monkeypatch.setattr(decisions, "WRITE_ATTEMPTS", 2)
+    project = crud.create_project(db, schemas.ProjectCreate(name="P", project_id="p", policy="default"))
+    key = crud.create_api_key(db, schemas.ApiKeyCreate(name="k", project_id=project.id))
+    log = schemas.LogEntryCreate(
+        project="P", threats_detected=[], content="hi", policy="default",
+        request_id="r1", latency=1, region="us-east-1",
+    )
+    counted = crud.guard_decision(log, "counts_only", project_id=project.id, api_key_id=key.id)
+    stored = crud.guard_decision(log, "full", project_id=project.id, api_key_id=key.id)
+
+    touch = crud.touch_api_keys_last_used
+    failures = []
+
+    def touch_once_failing(*args, **kwargs):
+        if not failures:
+            failures.append(1)
+            raise RuntimeError("database is locked")
+        return touch(*args, **kwargs)
+
+    monkeypatch.setattr(crud, "touch_api_keys_last_used", touch_once_failing)
+    writer = BackgroundLogWriter(SessionLocal, interval=0.001)
+    assert writer.write_with_retry([counted, stored])
+    assert writer.dropped == 0
+
+    db.expire_all()
+    rollup = db.query(models.ActivityRollup).filter(models.ActivityRollup.scope == "project").one()
+    assert rollup.requests == 2
+    assert db.query(models.LogEntry).count() == 1
+    assert db.query(models.ApiKey).filter(models.ApiKey.id == key.id).one().last_used is not None
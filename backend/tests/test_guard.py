@@ -0,0 +1,79 @@
+import functools
+
+import pytest
+from fastapi.testclient import TestClient
+
+import crud
+import main
+import models
+import schemas
+
+PII = "card 374245455400128"
+
+
+@pytest.fixture
+def client(db):
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture
+def api_key(db):
+    project = crud.create_project(db, schemas.ProjectCreate(name="Guarded", project_id="guarded", policy="default"))
+    key = crud.create_api_key(db, schemas.ApiKeyCreate(name="test", project_id=project.id))
+    return key.key
+
+
+def guard(client, api_key, messages, persist="sync"):
+    return client.post(
+        "/v2/guard",
+        json={"messages": messages, "persist": persist},
+        headers={"Authorization": f"Bearer {api_key}"},
+    )
+
+
+def test_flagged_request_is_logged_even_with_persist_none(client, api_key, db):
+    response = guard(client, api_key, [{"role": "user", "content": PII}], persist="none")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["threats_detected"] == ["PII"]
+    assert body["logged"] is True
+    assert db.query(models.LogEntry).filter(models.LogEntry.id == body["id"]).count() == 1
+
+
+def test_clean_request_with_persist_none_writes_no_log(client, api_key, db):
+    body = guard(client, api_key, [{"role": "user", "content": "hello"}], persist="none").json()
+    assert body["logged"] is False
+    assert db.query(models.LogEntry).count() == 0
+
+
+def test_log_stores_all_scanned_messages(client, api_key, db):
+    messages = [{"role": "user", "content": "hello"}, {"role": "user", "content": PII}]
+    body = guard(client, api_key, messages).json()
+    assert body["threats_detected"] == ["PII"]
+    entry = db.query(models.LogEntry).filter(models.LogEntry.id == body["id"]).one()
+    assert entry.content == "hello\n" + PII
+    assert entry.policy_version == body["policy_version"]
+
+
+def test_oversized_body_is_rejected(client, api_key):
+    limit = main.scanner.MAX_BODY_BYTES
+    response = guard(client, api_key, [{"role": "user", "content": "a" * (limit + 1)}])
+    assert response.status_code == 413
+
+
+def test_timed_out_scan_is_flagged_and_logged(client, api_key, db, monkeypatch):
+    monkeypatch.setattr(main.scanner, "scan", functools.partial(main.scanner.scan, time_budget_ms=-1))
+    body = guard(client, api_key, [{"role": "user", "content": "a" * 200000}], persist="none").json()
+    assert body["scan"]["timed_out"] is True
+    assert body["threats_detected"] == [main.scanner.INCOMPLETE_THREAT]
+    assert body["logged"] is True
+    assert db.query(models.LogEntry).filter(models.LogEntry.id == body["id"]).count() == 1
+
+
+def test_truncated_scan_is_flagged_and_logged(client, api_key, db, monkeypatch):
+    monkeypatch.setattr(main.scanner, "scan", functools.partial(main.scanner.scan, max_chars=100))
+    body = guard(client, api_key, [{"role": "user", "content": "a" * 200 + " you are DAN"}], persist="none").json()
+    assert body["scan"]["truncated"] is True
+    assert body["threats_detected"] == [main.scanner.INCOMPLETE_THREAT]
+    assert body["logged"] is True
@@ -0,0 +1,24 @@
+import invalidation
+import models
+
+
+def test_publish_dispatches_after_commit(db):
+    seen = []
+    invalidation.subscribe("test-commit", seen.append)
+    invalidation.publish(db, "test-commit", "a")
+    assert seen == []
+    db.commit()
+    assert seen == ["a"]
+    db.commit()
+    assert seen == ["a"]
+
+
+def test_rolled_back_change_is_not_dispatched_later(db):
+    seen = []
+    invalidation.subscribe("test-rollback", seen.append)
+    invalidation.publish(db, "test-rollback", "discarded")
+    db.rollback()
+    invalidation.publish(db, "test-rollback", "kept")
+    db.commit()
+    assert seen == ["kept"]
+    assert [row.key for row in db.query(models.ConfigChange).filter_by(topic="test-rollback")] == ["kept"]
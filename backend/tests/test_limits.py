@@ -0,0 +1,36 @@
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from limits import BodySizeLimitMiddleware
+
+
+def make_client(limit):
+    app = FastAPI()
+
+    @app.post("/limited")
+    async def limited(request: Request):
+        return {"size": len(await request.body())}
+
+    @app.post("/open")
+    async def open_(request: Request):
+        return {"size": len(await request.body())}
+
+    app.add_middleware(BodySizeLimitMiddleware, limits={"/limited": limit})
+    return TestClient(app)
+
+
+def test_content_length_over_limit_is_rejected():
+    client = make_client(10)
+    assert client.post("/limited", content=b"x" * 11).status_code == 413
+    assert client.post("/limited", content=b"x" * 10).json() == {"size": 10}
+
+
+def test_streamed_body_over_limit_is_rejected():
+    client = make_client(10)
+    chunks = iter([b"x" * 6, b"x" * 6])
+    assert client.post("/limited", content=chunks).status_code == 413
+
+
+def test_other_paths_are_not_limited():
+    client = make_client(10)
+    assert client.post("/open", content=b"x" * 100).json() == {"size": 100}
@@ -0,0 +1,46 @@
+import uuid
+
+import crud
+import models
+import schemas
+from crud import sample_fraction, should_store_log
+
+
+def test_sample_fraction_is_deterministic_and_in_range():
+    request_ids = [str(uuid.UUID(int=i)) for i in range(2000)]
+    first = [sample_fraction(r) for r in request_ids]
+    assert first == [sample_fraction(r) for r in request_ids]
+    assert all(0.0 <= value < 1.0 for value in first)
+    # Spread evenly enough that a 25% rate keeps roughly a quarter.
+    kept = sum(value < 0.25 for value in first) / len(first)
+    assert 0.2 < kept < 0.3
+
+
+def test_sample_fraction_known_value():
+    # Pinned so a change of hash (which would resample every worker differently) is noticed.
+    assert sample_fraction("request-1") == 0.9785382927311853
+
+
+def test_should_store_log_modes():
+    assert should_store_log("full", None, "r", flagged=False)
+    assert should_store_log("threats_only", None, "r", flagged=True)
+    assert not should_store_log("counts_only", None, "r", flagged=True)
+    assert not should_store_log("threats_only", None, "r", flagged=False)
+    assert not should_store_log("counts_only", None, "r", flagged=False)
+    assert not should_store_log("sampled", 0.0, "r", flagged=False)
+    assert should_store_log("sampled", 1.0, "r", flagged=False)
+    assert should_store_log("sampled", 0.5, "r", flagged=False) == (sample_fraction("r") < 0.5)
+
+
+def test_counts_only_stores_no_flagged_rows_unlike_threats_only(db):
+    log = schemas.LogEntryCreate(
+        project="P", threats_detected=["PII"], content="card", policy="default",
+        request_id="r1", latency=1, region="us-east-1",
+    )
+    crud.record_guard_decisions(db, [crud.guard_decision(log, "threats_only")])
+    assert db.query(models.LogEntry).count() == 1
+
+    crud.record_guard_decisions(db, [crud.guard_decision(log.model_copy(update={"request_id": "r2"}), "counts_only")])
+    assert db.query(models.LogEntry).count() == 1
+    rollup = db.query(models.ActivityRollup).filter(models.ActivityRollup.scope == "project").one()
+    assert (rollup.requests, rollup.threats) == (2, 2)
@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta, timezone
+
+import crud
+import models
+import retention
+import schemas
+import search
+from database import engine
+
+
+def add_log(db, content, threats, timestamp, project="p"):
+    crud.bulk_create_log_entries(db, [{
+        "project": project,
+        "threats_detected": threats,
+        "content": content,
+        "policy": "default",
+        "request_id": content,
+        "latency": 1,
+        "region": "us-east-1",
+        "timestamp": timestamp,
+    }])
+
+
+def test_search_applies_since_and_until(db):
+    search.ensure_search_index(engine)
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    add_log(db, "card old", ["PII"], now - timedelta(days=3))
+    add_log(db, "card new", ["PII"], now - timedelta(hours=1))
+
+    rows = crud.search_log_entry_rows(db, "card")
+    assert {row["content"] for row in rows} == {"card old", "card new"}
+    rows = crud.search_log_entry_rows(db, "card", since=now - timedelta(days=1))
+    assert [row["content"] for row in rows] == ["card new"]
+    rows = crud.search_log_entry_rows(db, "card", until=now - timedelta(days=1))
+    assert [row["content"] for row in rows] == ["card old"]
+
+
+def test_retention_removes_log_threats_rows(db):
+    now = datetime.now(timezone.utc)
+    add_log(db, "expired", ["PII"], now - timedelta(days=10), project="short")
+    add_log(db, "kept", ["PII"], now, project="short")
+    crud.create_project(db, schemas.ProjectCreate(name="short", project_id="short", policy="default", retention_days=1))
+
+    assert retention.enforce_retention(db)["short"] == 1
+    assert [row.content for row in db.query(models.LogEntry)] == ["kept"]
+    log_ids = {row.id for row in db.query(models.LogEntry)}
+    assert {row.log_id for row in db.query(models.LogThreat)} == log_ids
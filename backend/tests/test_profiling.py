@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import Counter
+
+import crud
+import models
+import profiling
+from database import engine
+from profiling import Profiler, RequestProfile, Sampler, Settings
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+
+def test_sampler_records_the_endpoint_stack_and_stops_when_idle():
+    sampler = Sampler(interval_ms=1)
+    profile = RequestProfile("GET", "/slow")
+    release = threading.Event()
+
+    def slow_endpoint():
+        release.wait(2)
+
+    endpoint = profiling.profiled_endpoint_call(slow_endpoint)
+
+    def run():
+        profiling._current_profile.set(profile)
+        endpoint()
+
+    worker = threading.Thread(target=run)
+    worker.start()
+    assert wait_for(lambda: profile.threads)
+    sampler.add(profile)
+    try:
+        assert wait_for(lambda: profile.stacks)
+    finally:
+        release.set()
+        worker.join()
+        sampler.remove(profile)
+    assert all(stack[0][0] == "slow_endpoint" for stack in profile.stacks)
+    assert wait_for(lambda: sampler._thread is None)
+
+
+def test_collapsed_stacks_are_rooted_at_the_request():
+    first = RequestProfile("GET", "/api/logs")
+    first.stacks = Counter({
+        (("list_logs", "/app/main.py", 10), ("query", "/app/crud.py", 20)): 3,
+        (("list_logs", "/app/main.py", 10),): 1,
+    })
+    second = RequestProfile("GET", "/api/logs")
+    second.stacks = Counter({(("list_logs", "/app/main.py", 10), ("query", "/app/crud.py", 20)): 2})
+    assert profiling.collapsed([first, second]) == (
+        "GET /api/logs;list_logs (main.py:10) 1\n"
+        "GET /api/logs;list_logs (main.py:10);query (crud.py:20) 5\n"
+    )
+
+
+def test_sql_hooks_count_statements_of_the_profiled_request(db):
+    profiler = Profiler(engine)
+    profiler.configure(Settings(enabled=True, sample_rate=1.0, until=time.time() + 60))
+    profile = RequestProfile("GET", "/api/projects")
+    token = profiling._current_profile.set(profile)
+    try:
+        for _ in range(profiling.REPEAT_THRESHOLD):
+            db.query(models.Project).filter(models.Project.id == "missing").all()
+    finally:
+        profiling._current_profile.reset(token)
+    db.query(models.Project).all()  # not profiled
+
+    assert profile.sql_count == profiling.REPEAT_THRESHOLD
+    [(statement, count)] = profile.repeated_statements()
+    assert "FROM projects" in statement and count == profiling.REPEAT_THRESHOLD
+
+
+def test_stored_settings_are_loaded_at_startup(db):
+    until = time.time() + 600
+    crud.put_app_setting(db, profiling.SETTINGS_NAME, Settings(True, 0.5, ("/v2/guard",), until)._asdict())
+    db.commit()
+    profiler = Profiler(engine)
+    profiler.load(db)
+    assert profiler.settings == Settings(True, 0.5, ("/v2/guard",), until)
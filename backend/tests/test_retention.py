@@ -0,0 +1,36 @@
+from fastapi.testclient import TestClient
+
+import auth
+import crud
+import main
+import models
+from database import SessionLocal
+from retention import RetentionScheduler
+
+
+def test_lease_is_exclusive_until_it_expires(db):
+    assert crud.acquire_lease(db, "job", "a", 60, now=1000)
+    assert not crud.acquire_lease(db, "job", "b", 60, now=1030)
+    assert crud.acquire_lease(db, "job", "a", 60, now=1030)  # the holder may extend
+    assert crud.acquire_lease(db, "job", "b", 60, now=1100)  # expired: taken over
+    assert db.query(models.JobLease).one().holder == "b"
+
+
+def test_only_one_scheduler_runs_per_interval(db):
+    first = RetentionScheduler(SessionLocal, interval=3600)
+    second = RetentionScheduler(SessionLocal, interval=3600)
+    assert first.acquire()
+    assert not second.acquire()
+
+
+def test_manual_run_requires_an_admin(db, monkeypatch):
+    monkeypatch.setenv("DISABLE_AUTH", "false")
+    monkeypatch.setenv("ADMIN_USER_IDS", "admin-user")
+    main.app.dependency_overrides[auth.verify_token] = lambda: {"sub": "regular-user"}
+    try:
+        with TestClient(main.app) as client:
+            assert client.post("/api/retention/run").status_code == 403
+            main.app.dependency_overrides[auth.verify_token] = lambda: {"sub": "admin-user"}
+            assert client.post("/api/retention/run").status_code == 200
+    finally:
+        main.app.dependency_overrides.clear()
@@ -0,0 +1,73 @@
+from scanner import INCOMPLETE_THREAT, iter_windows, joined_text, scan
+
+CARD = "374245455400128"
+
+
+def test_windows_overlap_and_cover_the_stream():
+    text = "".join(chr(ord("a") + i % 26) for i in range(100))
+    windows = list(iter_windows([text], chunk_chars=30, overlap=5, max_chars=1000))
+    assert windows[0] == (text[:30], 0)
+    assert all(carried == 5 for _, carried in windows[1:])
+    rebuilt = windows[0][0] + "".join(window[carried:] for window, carried in windows[1:])
+    assert rebuilt == text
+
+
+def test_match_across_chunk_boundary_is_found():
+    text = "x" * 95 + CARD + "y" * 50
+    result = scan([text], chunk_chars=100, overlap=32, stop_on_block=False)
+    assert result.threats == ["PII"]
+    assert result.scanned_chars == result.total_chars
+
+
+def test_match_longer_than_overlap_can_be_missed_at_boundary():
+    text = "x" * 95 + CARD + "y" * 50
+    assert scan([text], chunk_chars=100, overlap=0, stop_on_block=False).threats == []
+
+
+def test_match_across_message_boundary_uses_newline_join():
+    result = scan(["you are", "DAN"], chunk_chars=4, overlap=16)
+    assert result.threats == ["Jailbreak"]
+
+
+def test_word_cut_at_window_end_is_not_a_match():
+    # The first window ends inside "DANIEL", where \b would match at the cut.
+    text = "a" * (100 - 12) + " you are DANIEL, hello"
+    assert scan([text], chunk_chars=100, overlap=32).threats == []
+    assert scan(["a" * 80 + " AKIA" + "B" * 16 + "CDEF"], chunk_chars=100, overlap=32).threats == []
+
+
+def test_match_ending_the_stream_is_found():
+    result = scan(["a" * 88 + " you are DAN"], chunk_chars=50, overlap=32)
+    assert result.threats == ["Jailbreak"]
+
+
+def test_truncated_flag_at_max_chars():
+    result = scan(["a" * 500 + CARD], chunk_chars=64, overlap=16, max_chars=200)
+    assert result.truncated
+    assert result.threats == [INCOMPLETE_THREAT]
+    assert result.scanned_chars == 200
+    assert result.total_chars == 515
+
+
+def test_not_truncated_below_max_chars():
+    result = scan(["hello"], max_chars=200)
+    assert not result.truncated and not result.timed_out and not result.stopped_early
+
+
+def test_time_budget_sets_timed_out():
+    result = scan(["a" * 10000], chunk_chars=100, overlap=10, time_budget_ms=-1)
+    assert result.timed_out
+    assert result.scanned_chars < result.total_chars
+    assert result.threats == [INCOMPLETE_THREAT]
+
+
+def test_stop_on_block_reports_stopped_early():
+    result = scan([CARD + "a" * 1000], chunk_chars=100, overlap=20)
+    assert result.stopped_early
+    assert result.threats == ["PII"]
+
+
+def test_joined_text_matches_scanned_stream():
+    assert joined_text(["hello", "", "card " + CARD]) == "hello\ncard " + CARD
+    assert joined_text(["abc", "def"], max_chars=5) == "abc\nd"
+    assert joined_text(["abc"], max_chars=3) == "abc"
@@ -0,0 +1,48 @@
+import pytest
+
+import crud
+import schemas
+import snapshot
+
+
+@pytest.fixture(autouse=True)
+def fresh_snapshot(monkeypatch):
+    monkeypatch.setattr(snapshot, "_current", None)
+    monkeypatch.setattr(snapshot, "_stale", True)
+
+
+def test_failed_reload_keeps_the_snapshot_stale(db, monkeypatch):
+    first = snapshot.current(db)
+    snapshot._mark_stale()
+
+    def failing_load(session):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(snapshot, "load", failing_load)
+    with pytest.raises(RuntimeError):
+        snapshot.current(db)
+    assert snapshot._stale
+    monkeypatch.undo()
+    crud.create_project(db, schemas.ProjectCreate(name="New", project_id="new", policy="default"))
+    assert snapshot.current(db).version > first.version
+
+
+def test_invalidation_during_load_triggers_another_reload(db, monkeypatch):
+    real_load = snapshot.load
+
+    def racing_load(session):
+        loaded = real_load(session)
+        snapshot._mark_stale()
+        return loaded
+
+    monkeypatch.setattr(snapshot, "load", racing_load)
+    snapshot.current(db)
+    assert snapshot._stale
+
+
+def test_policy_version_cannot_be_supplied_by_clients():
+    log = schemas.LogEntryCreate(
+        project="p", threats_detected=[], content="c", policy="default",
+        request_id="r", latency=1, region="us-east-1", policy_version=999,
+    )
+    assert "policy_version" not in log.model_dump()
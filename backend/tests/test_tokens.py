@@ -0,0 +1,29 @@
+import pytest
+
+import tokens
+
+
+def test_failed_encoding_load_is_retried_later(monkeypatch):
+    pytest.importorskip("tiktoken")
+    calls = []
+
+    def failing_get_encoding(name):
+        calls.append(name)
+        raise OSError("offline")
+
+    monkeypatch.setattr(tokens.tiktoken, "get_encoding", failing_get_encoding)
+    monkeypatch.setattr(tokens, "_encodings", {})
+    monkeypatch.setattr(tokens, "_failed_until", {})
+    monkeypatch.setattr(tokens, "ENCODING_RETRY_SECONDS", 3600)
+    assert tokens.encoding_for("gpt-4") is None
+    assert tokens.encoding_for("gpt-4") is None
+    assert calls == ["cl100k_base"]
+
+    tokens._failed_until["cl100k_base"] = 0.0
+    assert tokens.encoding_for("gpt-4") is None
+    assert calls == ["cl100k_base", "cl100k_base"]
+
+
+def test_counts_fall_back_to_approximation(monkeypatch):
+    monkeypatch.setattr(tokens, "encoding_for", lambda model: None)
+    assert tokens.count_tokens("gpt-4", "hello world") == tokens.approximate_tokens("hello world") == 2
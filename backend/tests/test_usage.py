@@ -0,0 +1,63 @@
+import crud
+import models
+from usage import UsageMeter
+from database import SessionLocal
+
+
+def test_quota_counts_unflushed_tokens(db):
+    meter = UsageMeter(SessionLocal, interval=0)
+    assert meter.has_quota(db, "p1", 100, 100)
+    meter.record("p1", "gpt-4", 60, 20)
+    assert meter.used_today(db, "p1") == 80
+    assert meter.has_quota(db, "p1", 100, 20)
+    assert not meter.has_quota(db, "p1", 100, 21)
+    assert meter.has_quota(db, "p1", None, 10 ** 9)
+
+
+def test_usage_is_counted_once_across_a_flush(db):
+    meter = UsageMeter(SessionLocal, interval=0)
+    meter.record("p1", "gpt-4", 60, 20)
+    meter.used_today(db, "p1")  # load the project's total
+    assert meter.flush() == 1
+    assert meter.used_today(db, "p1") == 80
+    meter.record("p1", "gpt-4", 5, 5)
+    assert meter.used_today(db, "p1") == 90
+    assert meter.flush() == 1
+    assert meter.used_today(db, "p1") == 90
+    rows = db.query(models.TokenUsage).all()
+    assert sum(row.prompt_tokens + row.completion_tokens for row in rows) == 90
+
+
+def test_usage_stays_visible_while_a_flush_is_writing(db, monkeypatch):
+    meter = UsageMeter(SessionLocal, interval=0)
+    meter.record("p1", "gpt-4", 50, 0)
+    meter.used_today(db, "p1")
+    seen = []
+    write = crud.record_token_usage
+
+    def observing_write(session, pending):
+        write(session, pending)
+        seen.append(meter.used_today(db, "p1"))
+
+    monkeypatch.setattr(crud, "record_token_usage", observing_write)
+    meter.flush()
+    assert seen == [50]
+    assert meter.used_today(db, "p1") == 50
+
+
+def test_failed_flush_keeps_the_counts(db, monkeypatch):
+    meter = UsageMeter(SessionLocal, interval=0)
+    meter.record("p1", "gpt-4", 30, 0)
+
+    def failing_write(session, pending):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(crud, "record_token_usage", failing_write)
+    try:
+        meter.flush()
+    except RuntimeError:
+        pass
+    assert meter.used_today(db, "p1") == 30
+    monkeypatch.undo()
+    meter.flush()
+    assert meter.used_today(db, "p1") == 30
@@ -0,0 +1,158 @@
+import json
+import os
+import socket
+import time
+
+import pytest
+
+import crud
+import models
+import schemas
+import webhooks
+from database import SessionLocal
+
+
+def test_file_target_inside_events_dir(tmp_path):
+    path = webhooks.event_file_path(f"file://{tmp_path}/events.jsonl", str(tmp_path))
+    assert path == tmp_path.resolve() / "events.jsonl"
+
+
+@pytest.mark.parametrize("target", ["file:///etc/passwd", "file://{dir}/../outside.jsonl", "file://{dir}"])
+def test_file_target_outside_events_dir_is_rejected(tmp_path, target):
+    with pytest.raises(ValueError):
+        webhooks.event_file_path(target.format(dir=tmp_path), str(tmp_path))
+
+
+def test_file_target_through_symlink_is_rejected(tmp_path):
+    events = tmp_path / "events"
+    events.mkdir()
+    os.symlink(tmp_path / "secret.txt", events / "link.jsonl")
+    with pytest.raises(ValueError):
+        webhooks.event_file_path(f"file://{events}/link.jsonl", str(events))
+
+
+def test_file_targets_disabled_without_events_dir(monkeypatch):
+    monkeypatch.setattr(webhooks, "EVENTS_DIR", None)
+    with pytest.raises(ValueError):
+        webhooks.event_file_path("file:///tmp/events.jsonl")
+
+
+def test_deliver_appends_json_lines(tmp_path, monkeypatch):
+    monkeypatch.setattr(webhooks, "EVENTS_DIR", str(tmp_path))
+    dispatcher = webhooks.OutboxDispatcher(session_factory=None)
+    target = f"file://{tmp_path}/events.jsonl"
+    dispatcher.deliver(target, None, [{"event_id": 1}])
+    dispatcher.deliver(target, None, [{"event_id": 2}])
+    lines = (tmp_path / "events.jsonl").read_text().splitlines()
+    assert [json.loads(line)["event_id"] for line in lines] == [1, 2]
+
+
+def resolving_to(address):
+    return lambda host, port, **kwargs: [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (address, port))]
+
+
+@pytest.mark.parametrize("address", ["127.0.0.1", "10.0.0.5", "192.168.1.1", "169.254.169.254", "0.0.0.0"])
+def test_http_target_on_internal_address_is_rejected(monkeypatch, address):
+    monkeypatch.setattr(webhooks.socket, "getaddrinfo", resolving_to(address))
+    with pytest.raises(ValueError):
+        webhooks.check_http_target("https://hooks.example.com/in", allow_private=False)
+
+
+def test_http_target_on_public_address_is_accepted(monkeypatch):
+    monkeypatch.setattr(webhooks.socket, "getaddrinfo", resolving_to("93.184.216.34"))
+    webhooks.check_http_target("https://hooks.example.com/in", allow_private=False)
+
+
+def test_ipv6_loopback_target_is_rejected():
+    with pytest.raises(ValueError):
+        webhooks.check_http_target("http://[::1]:8080/hook", allow_private=False)
+
+
+@pytest.fixture
+def events_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(webhooks, "EVENTS_DIR", str(tmp_path))
+    return tmp_path / "events.jsonl"
+
+
+@pytest.fixture
+def subscription(db, events_file):
+    project = crud.create_project(db, schemas.ProjectCreate(name="Hooked", project_id="hooked", policy="default"))
+    return crud.create_webhook(db, project.id, schemas.WebhookCreate(target_url=f"file://{events_file}"))
+
+
+def add_events(db, subscription_id, count, attempts=0):
+    now = time.time()
+    db.execute(models.EventOutbox.__table__.insert(), [
+        {"subscription_id": subscription_id, "payload": {"n": i}, "status": "pending",
+         "attempts": attempts, "available_at": now}
+        for i in range(count)
+    ])
+    db.commit()
+
+
+def outbox(db):
+    db.expire_all()
+    return db.query(models.EventOutbox).order_by(models.EventOutbox.id).all()
+
+
+def test_dispatcher_delivers_in_order_and_deletes_rows(db, subscription, events_file):
+    add_events(db, subscription.id, 3)
+    dispatcher = webhooks.OutboxDispatcher(SessionLocal, interval=0, batch_size=2)
+    assert dispatcher.run_once() == 2
+    assert dispatcher.run_once() == 1
+    assert dispatcher.run_once() == 0
+    events = [json.loads(line) for line in events_file.read_text().splitlines()]
+    assert [e["n"] for e in events] == [0, 1, 2]
+    assert [e["event_id"] for e in events] == sorted(e["event_id"] for e in events)
+    assert outbox(db) == []
+    db.refresh(subscription)
+    assert subscription.leased_until is None
+
+
+def test_failed_batch_backs_off_and_is_retried(db, subscription, events_file, monkeypatch):
+    add_events(db, subscription.id, 2)
+    dispatcher = webhooks.OutboxDispatcher(SessionLocal, interval=0)
+    real_deliver = dispatcher.deliver
+
+    def failing_deliver(*args):
+        raise RuntimeError("connection refused")
+
+    monkeypatch.setattr(dispatcher, "deliver", failing_deliver)
+    before = time.time()
+    assert dispatcher.run_once() == 0
+    rows = outbox(db)
+    assert [row.attempts for row in rows] == [1, 1]
+    assert all(row.status == "pending" and row.available_at >= before + 2 for row in rows)
+    assert rows[0].last_error == "connection refused"
+    assert dispatcher.run_once() == 0  # still backing off
+
+    monkeypatch.setattr(dispatcher, "deliver", real_deliver)
+    db.query(models.EventOutbox).update({models.EventOutbox.available_at: 0})
+    db.commit()
+    assert dispatcher.run_once() == 2
+    assert len(events_file.read_text().splitlines()) == 2
+
+
+def test_only_rows_out_of_attempts_are_dead_lettered(db, subscription, monkeypatch):
+    monkeypatch.setattr(webhooks, "MAX_ATTEMPTS", 3)
+    add_events(db, subscription.id, 1, attempts=2)
+    add_events(db, subscription.id, 1, attempts=0)
+    dispatcher = webhooks.OutboxDispatcher(SessionLocal, interval=0)
+
+    def failing_deliver(*args):
+        raise RuntimeError("HTTP 500")
+
+    monkeypatch.setattr(dispatcher, "deliver", failing_deliver)
+    dispatcher.run_once()
+    rows = outbox(db)
+    assert [(row.status, row.attempts) for row in rows] == [("dead", 3), ("pending", 1)]
+    assert crud.get_webhook_rows(db, subscription.project_id)[0]["dead_events"] == 1
+
+
+def test_leased_subscription_is_skipped(db, subscription, events_file):
+    add_events(db, subscription.id, 1)
+    subscription.leased_until = time.time() + 60
+    db.commit()
+    assert webhooks.OutboxDispatcher(SessionLocal, interval=0).run_once() == 0
+    assert not events_file.exists()
+    assert len(outbox(db)) == 1
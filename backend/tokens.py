@@ -0,0 +1,117 @@
+"""Token counting for proxy traffic.
+
+Uses tiktoken's BPE encodings when available: each encoding is loaded once per
+process (its merge ranks are the expensive part, and the first load may
+download them), ``warm_up`` loads the common ones at startup off the request
+path, and texts are encoded one by one with ``encode_ordinary``
+(``encode_ordinary_batch`` starts a new thread pool per call, which costs more
+than it saves on request-sized inputs). When tiktoken is not installed or an
+encoding cannot be loaded (offline containers), counts fall back to a regex
+approximation of BPE pre-tokenization; a failed load is retried after
+``TIKTOKEN_RETRY_SECONDS`` rather than remembered forever.
+Models without a tiktoken mapping (Gemini, Claude) are counted with
+``cl100k_base``, which is close enough for accounting and quotas.
+"""
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Sequence
+
+try:
+    import tiktoken
+except ImportError:  # optional dependency
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENCODING = "cl100k_base"
+# Loaded at startup; cl100k_base covers GPT-4, GPT-3.5 and the models counted with the default.
+PRELOAD_ENCODINGS = (DEFAULT_ENCODING,)
+ENCODING_RETRY_SECONDS = float(os.getenv("TIKTOKEN_RETRY_SECONDS", "300"))
+
+# encoding name -> loaded encoding; only successful loads are kept.
+_encodings: Dict[str, object] = {}
+# encoding name -> monotonic time before which a failed load is not retried.
+_failed_until: Dict[str, float] = {}
+_load_lock = threading.Lock()
+
+# OpenAI chat format: every message costs a few framing tokens, and the reply is primed with 3 more.
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+# Words, numbers (up to 3 digits per token like cl100k), punctuation runs and whitespace.
+_PRETOKEN = re.compile(r"'(?:s|t|re|ve|m|ll|d)| ?[^\W\d_]+| ?\d{1,3}| ?[^\s\w]+|\s+", re.IGNORECASE)
+_CHARS_PER_WORD_TOKEN = 6
+
+
+def encoding_name(model: str) -> str:
+    """tiktoken's encoding name for ``model`` (a table lookup, nothing is loaded)."""
+    if tiktoken is not None:
+        try:
+            return tiktoken.encoding_name_for_model(model)
+        except KeyError:
+            pass
+    return DEFAULT_ENCODING
+
+
+def _load_encoding(name: str):
+    """Load (and possibly download) an encoding; failures are retried after ENCODING_RETRY_SECONDS."""
+    if time.monotonic() < _failed_until.get(name, 0.0):
+        return None
+    with _load_lock:
+        encoding = _encodings.get(name)
+        if encoding is not None or time.monotonic() < _failed_until.get(name, 0.0):
+            return encoding
+        try:
+            encoding = tiktoken.get_encoding(name)
+        except Exception:
+            logger.warning("Could not load the tiktoken encoding %s; using approximate token counts", name)
+            _failed_until[name] = time.monotonic() + ENCODING_RETRY_SECONDS
+            return None
+        _encodings[name] = encoding
+        _failed_until.pop(name, None)
+        return encoding
+
+
+def encoding_for(model: str):
+    """The tiktoken encoding for ``model``, or None when only the fallback is available."""
+    if tiktoken is None:
+        return None
+    name = encoding_name(model)
+    encoding = _encodings.get(name)
+    return encoding if encoding is not None else _load_encoding(name)
+
+
+def warm_up(names: Sequence[str] = PRELOAD_ENCODINGS) -> None:
+    """Load the common encodings ahead of the first request (run off the request path at startup)."""
+    if tiktoken is not None:
+        for name in names:
+            _load_encoding(name)
+
+
+def approximate_tokens(text: str) -> int:
+    """Regex estimate of the BPE token count; long words count as several tokens."""
+    count = 0
+    for match in _PRETOKEN.finditer(text):
+        count += 1 + (len(match.group()) - 1) // _CHARS_PER_WORD_TOKEN
+    return count
+
+
+def count_tokens_batch(model: str, texts: Sequence[str]) -> List[int]:
+    """Token counts of several texts with one encoding lookup."""
+    encoding = encoding_for(model)
+    if encoding is None:
+        return [approximate_tokens(text) for text in texts]
+    return [len(encoding.encode_ordinary(text)) for text in texts]
+
+
+def count_tokens(model: str, text: str) -> int:
+    return count_tokens_batch(model, [text])[0]
+
+
+def count_chat_tokens(model: str, messages: Sequence) -> int:
+    """Prompt tokens of a chat request (objects with ``role`` and ``content``)."""
+    texts = [part for message in messages for part in (message.role, message.content)]
+    return sum(count_tokens_batch(model, texts)) + TOKENS_PER_MESSAGE * len(messages) + TOKENS_PER_REPLY
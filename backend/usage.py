@@ -0,0 +1,153 @@
+"""Per-project token accounting and daily quotas for proxy traffic.
+
+``UsageMeter.record`` only updates in-memory counters; a daemon thread flushes
+them to the hourly ``token_usage`` rollup every ``USAGE_FLUSH_SECONDS`` with a
+single upsert, then reloads today's totals for the projects this worker has
+seen so usage from other workers is picked up. Quota checks read those totals
+plus this worker's unflushed counts and never query the history on the
+request path; a project's total is loaded once per day per worker.
+
+The quota check runs before the upstream call, so it compares the prompt
+tokens of the request with what is left; completion tokens are counted once
+the reply is known, and a request that fits may end slightly over the quota.
+"""
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import crud
+
+logger = logging.getLogger(__name__)
+
+FLUSH_SECONDS = float(os.getenv("USAGE_FLUSH_SECONDS", "5"))
+DAY_SECONDS = 86400
+
+
+def _day_start(now: float) -> int:
+    return int(now) // DAY_SECONDS * DAY_SECONDS
+
+
+class UsageMeter:
+    """In-memory token counters per worker, flushed to ``token_usage`` on a daemon thread."""
+
+    def __init__(self, session_factory, interval: float = FLUSH_SECONDS):
+        self.session_factory = session_factory
+        self.interval = interval
+        self._lock = threading.Lock()
+        # (project_id, model, hour) -> [requests, prompt_tokens, completion_tokens], not yet flushed
+        self._pending: Dict[tuple, List[int]] = defaultdict(lambda: [0, 0, 0])
+        self._unflushed_today: Dict[str, int] = defaultdict(int)
+        # Flushed tokens today per project, across all workers
+        self._today: Dict[str, int] = {}
+        self._day = _day_start(time.time())
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _roll_day(self, now: float) -> None:
+        day = _day_start(now)
+        if day != self._day:
+            self._day = day
+            self._today.clear()
+            self._unflushed_today.clear()
+
+    def record(self, project_id: str, model: str, prompt_tokens: int, completion_tokens: int) -> None:
+        now = time.time()
+        hour = int(now) // crud.USAGE_BUCKET_SECONDS * crud.USAGE_BUCKET_SECONDS
+        with self._lock:
+            self._roll_day(now)
+            counter = self._pending[(project_id, model, hour)]
+            counter[0] += 1
+            counter[1] += prompt_tokens
+            counter[2] += completion_tokens
+            self._unflushed_today[project_id] += prompt_tokens + completion_tokens
+
+    def used_today(self, db, project_id: str) -> int:
+        """Tokens used today by a project; loads its flushed total on first use."""
+        with self._lock:
+            self._roll_day(time.time())
+            flushed = self._today.get(project_id)
+            day = self._day
+        if flushed is None:
+            flushed = crud.get_token_totals(db, [project_id], day).get(project_id, 0)
+            with self._lock:
+                if day == self._day:
+                    self._today.setdefault(project_id, flushed)
+        with self._lock:
+            return self._today.get(project_id, flushed) + self._unflushed_today.get(project_id, 0)
+
+    def has_quota(self, db, project_id: str, quota: Optional[int], tokens: int) -> bool:
+        """Whether ``tokens`` more fit into the project's daily quota (None: unlimited)."""
+        if quota is None:
+            return True
+        return self.used_today(db, project_id) + tokens <= quota
+
+    def flush(self) -> int:
+        """Write pending counters and refresh today's totals; returns rows upserted.
+
+        The flushed tokens stay in ``_unflushed_today`` until the refreshed
+        totals replace ``_today``, and both change under one lock, so quota
+        checks never see the counts missing from both.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(lambda: [0, 0, 0])
+            in_flight = dict(self._unflushed_today)
+            day = self._day
+            known = list(self._today)
+        if not pending and not known:
+            return 0
+        db = self.session_factory()
+        try:
+            try:
+                crud.record_token_usage(db, pending)
+                db.commit()
+            except Exception:
+                db.rollback()
+                with self._lock:
+                    # Put the counts back so the next flush retries them.
+                    for key, (requests, prompt_tokens, completion_tokens) in pending.items():
+                        counter = self._pending[key]
+                        counter[0] += requests
+                        counter[1] += prompt_tokens
+                        counter[2] += completion_tokens
+                raise
+            with self._lock:
+                # Includes projects first loaded while the write was in progress.
+                known = list(self._today)
+            totals = crud.get_token_totals(db, known, day) if known else {}
+            db.commit()
+        finally:
+            db.close()
+        with self._lock:
+            if day == self._day:
+                for project_id, tokens in in_flight.items():
+                    remaining = self._unflushed_today[project_id] - tokens
+                    if remaining > 0:
+                        self._unflushed_today[project_id] = remaining
+                    else:
+                        del self._unflushed_today[project_id]
+                # Projects not loaded yet will read the flushed counts from the table.
+                for project_id in known:
+                    self._today[project_id] = totals.get(project_id, 0)
+        return len(pending)
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Flushing token usage failed")
+
+    def start(self) -> None:
+        if self._thread is None and self.interval > 0:
+            self._thread = threading.Thread(target=self._loop, name="token-usage", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Flushing token usage failed")
@@ -0,0 +1,332 @@
+"""Detection event streaming: transactional outbox plus batched, ordered delivery.
+
+``/v2/guard`` calls ``enqueue_detections`` in the same transaction as the log
+entry, adding one ``event_outbox`` row per active subscription of the project,
+so an event exists exactly when its log entry does. Nothing is sent on the
+request path: every worker runs an ``OutboxDispatcher`` that delivers pending
+rows in batches, in id order per subscription. A subscription is leased to one
+worker at a time, a failed batch is retried with exponential backoff before
+anything newer is sent, and each row counts its own attempts: a row still
+failing after ``WEBHOOK_MAX_ATTEMPTS`` is marked dead so it stops blocking the
+queue, while newer rows of the same batch keep their remaining attempts.
+
+Targets are ``http(s)://`` URLs (POST ``{"events": [...]}``, signed with
+HMAC-SHA256 when the subscription has a secret) or ``file://`` paths, which
+get one JSON line per event appended. File targets must resolve (after ``..``
+and symlinks) to a file inside ``WEBHOOK_EVENTS_DIR``; without that setting
+they are rejected. HTTP targets whose host resolves to a loopback, private,
+link-local or otherwise non-public address are rejected (when created and
+again before every delivery, and redirects are not followed) unless
+``WEBHOOK_ALLOW_PRIVATE_TARGETS`` is true. Secrets are stored in plaintext because signing needs the
+raw value; they are never returned by the API.
+"""
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+from sqlalchemy import case, event
+from sqlalchemy.orm import Session
+
+import invalidation
+import models
+
+logger = logging.getLogger(__name__)
+
+POLL_SECONDS = float(os.getenv("WEBHOOK_POLL_SECONDS", "1.0"))
+BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "100"))
+MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "12"))
+TIMEOUT_SECONDS = float(os.getenv("WEBHOOK_TIMEOUT_SECONDS", "5"))
+MAX_BACKOFF_SECONDS = 600
+LEASE_SECONDS = 60
+# file:// targets must resolve inside this directory; unset disables them.
+EVENTS_DIR = os.getenv("WEBHOOK_EVENTS_DIR")
+# http(s) targets may only reach public addresses unless this is set (local development).
+ALLOW_PRIVATE_TARGETS = os.getenv("WEBHOOK_ALLOW_PRIVATE_TARGETS", "false").lower() == "true"
+
+# project id -> [(subscription id, include_content)], loaded on first use.
+_subscriptions: Optional[Dict[str, List[Tuple[str, bool]]]] = None
+_subscriptions_generation = 0
+_wakeup = threading.Event()
+
+
+def _invalidate_subscriptions(key: Optional[str] = None) -> None:
+    global _subscriptions, _subscriptions_generation
+    _subscriptions_generation += 1
+    _subscriptions = None
+
+
+invalidation.subscribe("webhooks", _invalidate_subscriptions)
+invalidation.subscribe("projects", _invalidate_subscriptions)
+
+
+def active_subscriptions(db: Session) -> Dict[str, List[Tuple[str, bool]]]:
+    """Active subscriptions by project id, cached per worker until a webhook or project changes."""
+    global _subscriptions
+    cached = _subscriptions
+    if cached is not None:
+        return cached
+    generation = _subscriptions_generation
+    loaded: Dict[str, List[Tuple[str, bool]]] = {}
+    rows = (
+        db.query(
+            models.WebhookSubscription.id,
+            models.WebhookSubscription.project_id,
+            models.WebhookSubscription.include_content,
+        )
+        .filter(models.WebhookSubscription.is_active.is_(True))
+        .all()
+    )
+    for subscription_id, project_id, include_content in rows:
+        loaded.setdefault(project_id, []).append((subscription_id, bool(include_content)))
+    if generation == _subscriptions_generation:
+        _subscriptions = loaded
+    return loaded
+
+
+def event_payload(row: dict, include_content: bool) -> dict:
+    """The JSON body of one detection event, built from a log_entries row."""
+    payload = {
+        "type": "guard.detection",
+        "log_id": row["id"],
+        "request_id": row["request_id"],
+        "timestamp": row["timestamp"].isoformat(),
+        "project": row["project"],
+        "policy": row["policy"],
+        "threats_detected": row["threats_detected"],
+        "latency": row["latency"],
+        "region": row["region"],
+        "policy_version": row.get("policy_version"),
+    }
+    if include_content:
+        payload["content"] = row["content"]
+    return payload
+
+
+def enqueue_detections(db: Session, project_id: Optional[str], rows: List[dict]) -> int:
+    """Add outbox rows for flagged log rows of a project (no commit); returns how many."""
+    subscriptions = active_subscriptions(db).get(project_id) if project_id else None
+    if not subscriptions:
+        return 0
+    now = time.time()
+    outbox = [
+        {
+            "subscription_id": subscription_id,
+            "payload": event_payload(row, include_content),
+            "status": "pending",
+            "attempts": 0,
+            "available_at": now,
+        }
+        for row in rows
+        if row.get("threats_detected")
+        for subscription_id, include_content in subscriptions
+    ]
+    if outbox:
+        db.execute(models.EventOutbox.__table__.insert(), outbox)
+        event.listen(db, "after_commit", lambda session: _wakeup.set(), once=True)
+    return len(outbox)
+
+
+def event_file_path(target_url: str, events_dir: Optional[str] = None) -> Path:
+    """The file a ``file://`` target appends to; raises ValueError unless it is inside the events directory."""
+    events_dir = events_dir or EVENTS_DIR
+    if not events_dir:
+        raise ValueError("file:// targets are disabled; set WEBHOOK_EVENTS_DIR to allow them")
+    root = Path(events_dir).resolve()
+    path = Path(unquote(urlparse(target_url).path)).resolve()
+    if root not in path.parents:
+        raise ValueError(f"file:// targets must be inside {root}")
+    return path
+
+
+def check_http_target(target_url: str, allow_private: Optional[bool] = None) -> None:
+    """Raise ValueError unless every address the target's host resolves to is public."""
+    if ALLOW_PRIVATE_TARGETS if allow_private is None else allow_private:
+        return
+    parsed = urlparse(target_url)
+    if not parsed.hostname:
+        raise ValueError("Webhook target has no host")
+    port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    try:
+        infos = socket.getaddrinfo(parsed.hostname, port, proto=socket.IPPROTO_TCP)
+    except socket.gaierror as exc:
+        raise ValueError(f"Cannot resolve {parsed.hostname}: {exc}")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%", 1)[0])
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        if not address.is_global or address.is_multicast:
+            raise ValueError(f"Webhook targets must be public; {parsed.hostname} resolves to {address}")
+
+
+def check_target(target_url: str) -> None:
+    """Raise ValueError if the dispatcher may not deliver to ``target_url``."""
+    if urlparse(target_url).scheme == "file":
+        event_file_path(target_url)
+    else:
+        check_http_target(target_url)
+
+
+def sign(secret: str, body: bytes) -> str:
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+class OutboxDispatcher:
+    """Delivers ``event_outbox`` rows on a daemon thread.
+
+    Wakes up every ``interval`` seconds, or right after this worker commits new
+    events, and keeps going while full batches are pending.
+    """
+
+    def __init__(self, session_factory, interval: float = POLL_SECONDS, batch_size: int = BATCH_SIZE):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._http = None
+
+    def deliver(self, target_url: str, secret: Optional[str], events: List[dict]) -> None:
+        """Send one batch; raises if the target did not accept it."""
+        parsed = urlparse(target_url)
+        if parsed.scheme == "file":
+            # Checked again on every delivery: a symlink may have appeared since the subscription was created.
+            path = event_file_path(target_url)
+            lines = "".join(json.dumps(e, separators=(",", ":")) + "\n" for e in events)
+            flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_NOFOLLOW", 0)
+            with os.fdopen(os.open(path, flags, 0o600), "a", encoding="utf-8") as fh:
+                fh.write(lines)
+                fh.flush()
+                os.fsync(fh.fileno())
+            return
+
+        if self._http is None:
+            import requests
+
+            self._http = requests.Session()
+        # Checked again on every delivery: DNS may point somewhere else by now.
+        check_http_target(target_url)
+        body = json.dumps({"events": events}, separators=(",", ":")).encode()
+        headers = {"Content-Type": "application/json"}
+        if secret:
+            headers["X-LeakGuard-Signature"] = sign(secret, body)
+        response = self._http.post(
+            target_url, data=body, headers=headers, timeout=TIMEOUT_SECONDS, allow_redirects=False
+        )
+        if response.status_code >= 300:
+            raise RuntimeError(f"HTTP {response.status_code}")
+
+    def _lease(self, db: Session, subscription_id: str, now: float) -> bool:
+        Subscription = models.WebhookSubscription
+        leased = (
+            db.query(Subscription)
+            .filter(
+                Subscription.id == subscription_id,
+                Subscription.is_active.is_(True),
+                (Subscription.leased_until.is_(None)) | (Subscription.leased_until < now),
+            )
+            .update({Subscription.leased_until: now + LEASE_SECONDS}, synchronize_session=False)
+        )
+        db.commit()
+        return leased == 1
+
+    def _release(self, db: Session, subscription_id: str) -> None:
+        db.query(models.WebhookSubscription).filter(models.WebhookSubscription.id == subscription_id).update(
+            {models.WebhookSubscription.leased_until: None}, synchronize_session=False
+        )
+
+    def _drain_subscription(self, db: Session, subscription_id: str) -> int:
+        """Deliver the next batch of one subscription; returns the number of events sent."""
+        now = time.time()
+        if not self._lease(db, subscription_id, now):
+            return 0
+        Outbox = models.EventOutbox
+        try:
+            target, secret = (
+                db.query(models.WebhookSubscription.target_url, models.WebhookSubscription.secret)
+                .filter(models.WebhookSubscription.id == subscription_id)
+                .one()
+            )
+            rows = (
+                db.query(Outbox.id, Outbox.payload, Outbox.attempts, Outbox.available_at)
+                .filter(Outbox.subscription_id == subscription_id, Outbox.status == "pending")
+                .order_by(Outbox.id)
+                .limit(self.batch_size)
+                .all()
+            )
+            # The oldest event gates the rest so delivery stays in order during backoff.
+            if not rows or rows[0].available_at > now:
+                return 0
+            db.commit()
+            ids = [row.id for row in rows]
+            try:
+                self.deliver(target, secret, [dict(row.payload, event_id=row.id) for row in rows])
+            except Exception as exc:
+                # Each row keeps its own count; the batch backs off by its most-retried row.
+                attempts = max(row.attempts for row in rows) + 1
+                dead = sum(1 for row in rows if row.attempts + 1 >= MAX_ATTEMPTS)
+                backoff = min(MAX_BACKOFF_SECONDS, 2 ** attempts)
+                db.query(Outbox).filter(Outbox.id.in_(ids)).update(
+                    {
+                        Outbox.attempts: Outbox.attempts + 1,
+                        Outbox.available_at: time.time() + backoff,
+                        Outbox.status: case((Outbox.attempts + 1 >= MAX_ATTEMPTS, "dead"), else_="pending"),
+                        Outbox.last_error: str(exc)[:500],
+                    },
+                    synchronize_session=False,
+                )
+                logger.warning(
+                    "Webhook delivery of %d events to %s failed (attempt %d, %d dead): %s",
+                    len(ids), target, attempts, dead, exc,
+                )
+                return 0
+            db.query(Outbox).filter(Outbox.id.in_(ids)).delete(synchronize_session=False)
+            return len(ids)
+        finally:
+            self._release(db, subscription_id)
+            db.commit()
+
+    def run_once(self) -> int:
+        """Deliver one batch for every subscription with due events; returns events sent."""
+        db = self.session_factory()
+        try:
+            due = [
+                subscription_id
+                for (subscription_id,) in db.query(models.EventOutbox.subscription_id)
+                .filter(models.EventOutbox.status == "pending", models.EventOutbox.available_at <= time.time())
+                .distinct()
+                .all()
+            ]
+            db.commit()
+            return sum(self._drain_subscription(db, subscription_id) for subscription_id in due)
+        finally:
+            db.close()
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                sent = self.run_once()
+            except Exception:
+                logger.exception("Webhook delivery failed")
+                sent = 0
+            if sent >= self.batch_size:
+                continue
+            _wakeup.wait(self.interval)
+            _wakeup.clear()
+
+    def start(self) -> None:
+        if self._thread is None and self.interval > 0:
+            self._thread = threading.Thread(target=self._loop, name="webhook-delivery", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        _wakeup.set()